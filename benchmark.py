@@ -0,0 +1,589 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#   "fastapi[standard]",
+#   "uvicorn",
+#   "httpx",
+# ]
+# ///
+
+# Offline benchmark for /handle_task.
+#
+# Starts a fake GitHub API and a fake OpenAI compatible chat completions server
+# in this process, runs main.py against them in a uvicorn subprocess and drives
+# round 1 and round 2 tasks at a fixed concurrency. Nothing leaves the machine.
+#
+#   uv run benchmark.py --tasks 50 --concurrency 10 --github-latency 0.1 --llm-latency 2
+#   uv run benchmark.py --env GITHUB_PUSH_MODE=contents --env LLM_STREAM=true
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+OWNER = "bench-user"
+SECRET = "bench-secret"
+
+def git_blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def object_sha(kind: str, data) -> str:
+    return hashlib.sha1(f"{kind} {json.dumps(data, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+class FakeGitHub:
+    """Just enough of the GitHub REST API for main.py: repos, pages, contents and git data."""
+
+    def __init__(self, latency: float, error_rate: float, pages_build_time: float = 2.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.pages_build_time = pages_build_time
+        self.calls = Counter()
+        self.blobs: dict[str, bytes] = {}
+        # Trees are flat {path: blob sha} maps, commits are {"tree", "parents"}
+        self.trees: dict[str, dict[str, str]] = {}
+        self.commits: dict[str, dict] = {}
+        self.repos: dict[str, dict] = {}
+        self.app = self.create_app()
+
+    def put_blob(self, content: bytes) -> str:
+        sha = git_blob_sha(content)
+        self.blobs[sha] = content
+        return sha
+
+    def put_tree(self, entries: dict[str, str]) -> str:
+        sha = object_sha("tree", entries)
+        self.trees[sha] = dict(entries)
+        return sha
+
+    def put_commit(self, tree_sha: str, parents: list[str], message: str) -> str:
+        data = {"tree": tree_sha, "parents": parents, "message": message, "time": time.time_ns()}
+        sha = object_sha("commit", data)
+        self.commits[sha] = data
+        return sha
+
+    def head_tree(self, repo: dict) -> dict[str, str]:
+        return self.trees[self.commits[repo["head"]]["tree"]]
+
+    def commit_files(self, repo: dict, entries: dict[str, str], message: str) -> str:
+        commit_sha = self.put_commit(self.put_tree(entries), [repo["head"]], message)
+        self.set_head(repo, commit_sha)
+        return commit_sha
+
+    def set_head(self, repo: dict, commit_sha: str):
+        repo["head"] = commit_sha
+        repo["pushed_at"] = time.time()
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+        github = self
+
+        @app.middleware("http")
+        async def simulate(request: Request, call_next):
+            await asyncio.sleep(github.latency * random.uniform(0.5, 1.5))
+            if random.random() < github.error_rate:
+                github.calls[f"{request.method} (injected 502)"] += 1
+                return JSONResponse(status_code=502, content={"message": "Injected error"})
+            response = await call_next(request)
+            route = request.scope.get("route")
+            # Conditional requests answered with 304 are free, count them apart
+            suffix = " (304)" if response.status_code == 304 else ""
+            github.calls[f"{request.method} {route.path if route else request.url.path}{suffix}"] += 1
+            response.headers["X-RateLimit-Limit"] = "1000000"
+            response.headers["X-RateLimit-Remaining"] = "999999"
+            response.headers["X-RateLimit-Reset"] = str(int(time.time()) + 3600)
+            return response
+
+        @app.post("/evaluation")
+        async def evaluation(body: dict):
+            # Stands in for the evaluator's evaluation_url
+            return {"status": "ok"}
+
+        def not_found():
+            return JSONResponse(status_code=404, content={"message": "Not Found"})
+
+        def conditional(request: Request, body: dict) -> Response:
+            # GitHub answers a matching If-None-Match with a 304 that doesn't count against the rate limit
+            etag = f'"{object_sha("etag", body)}"'
+            if request.headers.get("If-None-Match") == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            return JSONResponse(content=body, headers={"ETag": etag})
+
+        @app.post("/user/repos")
+        async def create_repo(body: dict):
+            name = body["name"]
+            if name in github.repos:
+                return JSONResponse(status_code=422, content={"message": "Repository creation failed.", "errors": [{"message": "name already exists on this account"}]})
+            entries = {}
+            if body.get("auto_init"):
+                entries["README.md"] = github.put_blob(f"# {name}\n".encode())
+            if body.get("license_template"):
+                entries["LICENSE"] = github.put_blob(b"MIT License\n")
+            github.repos[name] = {"name": name, "pages": None}
+            github.set_head(github.repos[name], github.put_commit(github.put_tree(entries), [], "Initial commit"))
+            return JSONResponse(status_code=201, content=repo_json(name))
+
+        def repo_json(name: str) -> dict:
+            return {"name": name, "full_name": f"{OWNER}/{name}", "html_url": f"https://github.com/{OWNER}/{name}", "default_branch": "main"}
+
+        @app.get("/repos/{owner}/{repo}")
+        async def get_repo(owner: str, repo: str):
+            if repo not in github.repos:
+                return not_found()
+            return repo_json(repo)
+
+        @app.patch("/repos/{owner}/{repo}")
+        async def update_repo(owner: str, repo: str, body: dict):
+            if repo not in github.repos:
+                return not_found()
+            name = body.get("name", repo)
+            if name != repo:
+                if name in github.repos:
+                    return JSONResponse(status_code=422, content={"message": "Validation Failed", "errors": [{"message": "name already exists on this account"}]})
+                github.repos[name] = github.repos.pop(repo)
+                github.repos[name]["name"] = name
+            return repo_json(name)
+
+        @app.delete("/repos/{owner}/{repo}")
+        async def delete_repo(owner: str, repo: str):
+            if github.repos.pop(repo, None) is None:
+                return not_found()
+            return Response(status_code=204)
+
+        @app.post("/repos/{owner}/{repo}/pages")
+        async def enable_pages(owner: str, repo: str, body: dict):
+            if repo not in github.repos:
+                return not_found()
+            if github.repos[repo]["pages"]:
+                return JSONResponse(status_code=409, content={"message": "GitHub Pages is already enabled."})
+            github.repos[repo]["pages"] = body.get("source", {})
+            return JSONResponse(status_code=201, content={"html_url": f"https://{OWNER}.github.io/{repo}/", "status": "queued"})
+
+        @app.get("/repos/{owner}/{repo}/pages/builds/latest")
+        async def latest_pages_build(owner: str, repo: str, request: Request):
+            state = github.repos.get(repo)
+            if state is None or not state["pages"]:
+                return not_found()
+            # Every push starts a build that takes pages_build_time seconds
+            built = time.time() - state["pushed_at"] >= github.pages_build_time
+            build = {"status": "built" if built else "building", "commit": state["head"], "error": {"message": None}}
+            return conditional(request, build)
+
+        @app.get("/repos/{owner}/{repo}/contents/{path:path}")
+        async def get_contents(owner: str, repo: str, path: str, request: Request):
+            if repo not in github.repos:
+                return not_found()
+            sha = github.head_tree(github.repos[repo]).get(path)
+            if sha is None:
+                return not_found()
+            content = github.blobs[sha]
+            return conditional(request, {"type": "file", "path": path, "sha": sha, "size": len(content), "encoding": "base64", "content": base64.b64encode(content).decode()})
+
+        @app.put("/repos/{owner}/{repo}/contents/{path:path}")
+        async def put_contents(owner: str, repo: str, path: str, body: dict):
+            if repo not in github.repos:
+                return not_found()
+            state = github.repos[repo]
+            entries = dict(github.head_tree(state))
+            current = entries.get(path)
+            if current and body.get("sha") is None:
+                return JSONResponse(status_code=422, content={"message": "\"sha\" wasn't supplied."})
+            if current and body["sha"] != current:
+                return JSONResponse(status_code=409, content={"message": f"{path} does not match {body['sha']}"})
+            entries[path] = github.put_blob(base64.b64decode(body["content"]))
+            commit_sha = github.commit_files(state, entries, body.get("message", ""))
+            return JSONResponse(status_code=200 if current else 201, content={"content": {"path": path, "sha": entries[path]}, "commit": {"sha": commit_sha}})
+
+        @app.delete("/repos/{owner}/{repo}/contents/{path:path}")
+        async def delete_contents(owner: str, repo: str, path: str, body: dict):
+            if repo not in github.repos:
+                return not_found()
+            state = github.repos[repo]
+            entries = dict(github.head_tree(state))
+            if path not in entries:
+                return not_found()
+            if body.get("sha") != entries[path]:
+                return JSONResponse(status_code=409, content={"message": "sha does not match"})
+            del entries[path]
+            commit_sha = github.commit_files(state, entries, body.get("message", ""))
+            return {"content": None, "commit": {"sha": commit_sha}}
+
+        @app.get("/repos/{owner}/{repo}/git/ref/heads/{branch}")
+        async def get_ref(owner: str, repo: str, branch: str, request: Request):
+            if repo not in github.repos or branch != "main":
+                return not_found()
+            return conditional(request, {"ref": "refs/heads/main", "object": {"type": "commit", "sha": github.repos[repo]["head"]}})
+
+        @app.patch("/repos/{owner}/{repo}/git/refs/heads/{branch}")
+        async def update_ref(owner: str, repo: str, branch: str, body: dict):
+            if repo not in github.repos or branch != "main":
+                return not_found()
+            state = github.repos[repo]
+            commit = github.commits.get(body["sha"])
+            if commit is None:
+                return JSONResponse(status_code=422, content={"message": "Object does not exist"})
+            if state["head"] not in commit["parents"] and not body.get("force"):
+                return JSONResponse(status_code=422, content={"message": "Update is not a fast forward"})
+            github.set_head(state, body["sha"])
+            return {"ref": "refs/heads/main", "object": {"type": "commit", "sha": body["sha"]}}
+
+        @app.get("/repos/{owner}/{repo}/git/commits/{sha}")
+        async def get_commit(owner: str, repo: str, sha: str):
+            commit = github.commits.get(sha)
+            if repo not in github.repos or commit is None:
+                return not_found()
+            return {"sha": sha, "tree": {"sha": commit["tree"]}, "parents": [{"sha": parent} for parent in commit["parents"]]}
+
+        @app.post("/repos/{owner}/{repo}/git/commits")
+        async def create_commit(owner: str, repo: str, body: dict):
+            if repo not in github.repos or body["tree"] not in github.trees:
+                return not_found()
+            return JSONResponse(status_code=201, content={"sha": github.put_commit(body["tree"], body.get("parents", []), body.get("message", ""))})
+
+        @app.get("/repos/{owner}/{repo}/git/trees/{ref}")
+        async def get_tree(owner: str, repo: str, ref: str, request: Request):
+            if repo not in github.repos:
+                return not_found()
+            state = github.repos[repo]
+            tree_sha = github.commits[state["head"]]["tree"] if ref == "main" else ref
+            if tree_sha not in github.trees:
+                return not_found()
+            entries = [
+                {"path": path, "mode": "100644", "type": "blob", "sha": sha, "size": len(github.blobs[sha])}
+                for path, sha in sorted(github.trees[tree_sha].items())
+            ]
+            return conditional(request, {"sha": tree_sha, "tree": entries, "truncated": False})
+
+        @app.post("/repos/{owner}/{repo}/git/trees")
+        async def create_tree(owner: str, repo: str, body: dict):
+            if repo not in github.repos:
+                return not_found()
+            entries = dict(github.trees.get(body.get("base_tree"), {}))
+            for entry in body["tree"]:
+                if "content" in entry:
+                    entries[entry["path"]] = github.put_blob(entry["content"].encode("utf-8"))
+                elif entry.get("sha") is None:
+                    entries.pop(entry["path"], None)
+                elif entry["sha"] in github.blobs:
+                    entries[entry["path"]] = entry["sha"]
+                else:
+                    return JSONResponse(status_code=422, content={"message": f"Invalid tree entry {entry['path']}"})
+            return JSONResponse(status_code=201, content={"sha": github.put_tree(entries)})
+
+        @app.post("/repos/{owner}/{repo}/git/blobs")
+        async def create_blob(owner: str, repo: str, body: dict):
+            if repo not in github.repos:
+                return not_found()
+            content = body["content"].encode("utf-8") if body.get("encoding", "utf-8") == "utf-8" else base64.b64decode(body["content"])
+            return JSONResponse(status_code=201, content={"sha": github.put_blob(content)})
+
+        @app.get("/repos/{owner}/{repo}/git/blobs/{sha}")
+        async def get_blob(owner: str, repo: str, sha: str):
+            if repo not in github.repos or sha not in github.blobs:
+                return not_found()
+            content = github.blobs[sha]
+            return {"sha": sha, "size": len(content), "encoding": "base64", "content": base64.b64encode(content).decode()}
+
+        return app
+
+class FakeLLM:
+    """OpenAI compatible /chat/completions returning a generated app as a JSON array of files."""
+
+    def __init__(self, latency: float, error_rate: float, files: int, file_size: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.files = files
+        self.file_size = file_size
+        self.calls = Counter()
+        self.app = self.create_app()
+
+    def completion(self, prompt: str, structured: bool) -> str:
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        names = ["index.html", "README.md", "script.js", "style.css"] + [f"assets/extra{i}.js" for i in range(self.files)]
+        files = [
+            {"name": name, "content": f"/* {name} {seed[:12]} */\n" + ("x" * 63 + "\n") * (self.file_size // 64)}
+            for name in names[:self.files]
+        ]
+        if structured:
+            # What a json_schema response_format produces: bare, compact JSON
+            return json.dumps({"files": files})
+        return "```json\n" + json.dumps(files, indent=2) + "\n```"
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+        llm = self
+
+        @app.post("/chat/completions")
+        async def chat_completions(body: dict):
+            llm.calls["POST /chat/completions" + (" (stream)" if body.get("stream") else "")] += 1
+            if random.random() < llm.error_rate:
+                await asyncio.sleep(llm.latency * 0.1)
+                return JSONResponse(status_code=502, content={"error": {"message": "Injected error"}})
+
+            prompt = body["messages"][-1]["content"]
+            content = llm.completion(prompt, "response_format" in body)
+            usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4}
+            latency = llm.latency * random.uniform(0.5, 1.5)
+
+            if not body.get("stream"):
+                await asyncio.sleep(latency)
+                return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}], "usage": usage}
+
+            async def events():
+                # Spread the completion over the latency in small deltas
+                chunks = [content[i:i + 200] for i in range(0, len(content), 200)]
+                for chunk in chunks:
+                    await asyncio.sleep(latency / len(chunks))
+                    yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': chunk}}]})}\n\n"
+                yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return app
+
+def start_server(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def task_payload(task: str, round_num: int, evaluation_url: str) -> dict:
+    payload = {
+        "email": "bench@example.com",
+        "secret": SECRET,
+        "task": task,
+        "round": round_num,
+        "nonce": "bench",
+        "brief": f"Benchmark app {task}",
+        "checks": [],
+        "evaluation_url": evaluation_url,
+    }
+    if round_num == 2:
+        payload["evaluation_feedback"] = f"Improve {task}"
+    return payload
+
+async def drive_round(base_url: str, round_num: int, tasks: list[str], concurrency: int, poll_interval: float,
+                      evaluation_url: str, batch: bool = False) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    accept_latencies = []
+    latencies = []
+    pages_latencies = []
+    statuses = Counter()
+
+    async def run_task(client: httpx.AsyncClient, task: str):
+        payload = task_payload(task, round_num, evaluation_url)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(f"{base_url}/handle_task", json=payload)
+            accept_latencies.append(time.perf_counter() - start)
+            job = response.json()
+            job_id = job.get("job_id")
+            if job_id is None:
+                statuses["rejected"] += 1
+                return
+            while job.get("status") in ("queued", "running"):
+                await asyncio.sleep(poll_interval)
+                job = (await client.get(f"{base_url}/jobs/{job_id}")).json()
+            latencies.append(time.perf_counter() - start)
+            failed = job.get("status") != "completed" or "error" in (job.get("result") or {})
+            statuses["failed" if failed else "completed"] += 1
+
+        # With PAGES_WAIT the job reports the Pages build once it is published
+        while (job.get("result") or {}).get("pages_status") == "pending":
+            await asyncio.sleep(poll_interval)
+            job = (await client.get(f"{base_url}/jobs/{job_id}")).json()
+        if (job.get("result") or {}).get("pages_status") == "ready":
+            pages_latencies.append(time.perf_counter() - start)
+
+    async def run_batch(client: httpx.AsyncClient):
+        # One /handle_tasks request, then one /batches poll for all of them
+        payloads = [task_payload(task, round_num, evaluation_url) for task in tasks]
+        start = time.perf_counter()
+        response = await client.post(f"{base_url}/handle_tasks", json={"secret": SECRET, "tasks": payloads})
+        accept_latencies.append(time.perf_counter() - start)
+        batch = response.json()
+        if "batch_id" not in batch:
+            statuses["rejected"] += len(tasks)
+            return
+        running = {job["job_id"] for job in batch["jobs"] if "job_id" in job}
+        statuses["rejected"] += len(tasks) - len(running)
+        building = set()
+        while running or building:
+            await asyncio.sleep(poll_interval)
+            status = (await client.get(f"{base_url}/batches/{batch['batch_id']}")).json()
+            for job in status["jobs"]:
+                result = job.get("result") or {}
+                if job["id"] in running and job["status"] not in ("queued", "running"):
+                    running.discard(job["id"])
+                    latencies.append(time.perf_counter() - start)
+                    failed = job["status"] != "completed" or "error" in result
+                    statuses["failed" if failed else "completed"] += 1
+                    if result.get("pages_status") == "pending":
+                        building.add(job["id"])
+                if job["id"] in building and result.get("pages_status") != "pending":
+                    building.discard(job["id"])
+                    if result.get("pages_status") == "ready":
+                        pages_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=concurrency * 2 + 10)) as client:
+        if batch:
+            await run_batch(client)
+        else:
+            await asyncio.gather(*(run_task(client, task) for task in tasks))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "round": round_num,
+        "tasks": len(tasks),
+        "completed": statuses["completed"],
+        "failed": statuses["failed"],
+        "rejected": statuses["rejected"],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_tasks_per_second": round(len(tasks) / elapsed, 3) if elapsed else 0.0,
+        "accept_latency_seconds": {f"p{int(q * 100)}": round(percentile(accept_latencies, q), 4) for q in (0.5, 0.95, 0.99)},
+        "latency_seconds": {f"p{int(q * 100)}": round(percentile(latencies, q), 4) for q in (0.5, 0.95, 0.99)},
+        "pages_ready": len(pages_latencies),
+        "pages_ready_seconds": {f"p{int(q * 100)}": round(percentile(pages_latencies, q), 4) for q in (0.5, 0.95, 0.99)},
+    }
+
+def wait_for_app(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"main.py exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("main.py did not become healthy in time")
+
+def wait_for_repo_pool(base_url: str, size: int, timeout: float = 120):
+    # Measure round 1 against a full pool rather than one still being filled
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        metrics = httpx.get(f"{base_url}/metrics", timeout=5).text
+        if f'captcha_agent_repo_pool{{status="ready"}} {size}' in metrics:
+            return
+        time.sleep(0.2)
+    raise SystemExit("repo pool did not fill in time")
+
+def print_report(report: dict):
+    print()
+    print(f"{'round':>5} {'tasks':>6} {'ok':>5} {'fail':>5} {'secs':>8} {'tasks/s':>8} {'accept p50/p95/p99 (s)':>24} {'latency p50/p95/p99 (s)':>26}")
+    for result in report["rounds"]:
+        accept = "/".join(f"{v:.3f}" for v in result["accept_latency_seconds"].values())
+        latency = "/".join(f"{v:.2f}" for v in result["latency_seconds"].values())
+        print(f"{result['round']:>5} {result['tasks']:>6} {result['completed']:>5} {result['failed'] + result['rejected']:>5} "
+              f"{result['elapsed_seconds']:>8.2f} {result['throughput_tasks_per_second']:>8.2f} {accept:>24} {latency:>26}")
+        if result["pages_ready"]:
+            pages = "/".join(f"{v:.2f}" for v in result["pages_ready_seconds"].values())
+            print(f"      pages ready: {result['pages_ready']} tasks, p50/p95/p99 {pages}s")
+        print(f"      outbound calls: {result['github_calls_total']} GitHub ({result['github_calls_per_task']:.1f}/task), {result['llm_calls_total']} LLM")
+        for route, count in sorted(result["github_calls"].items(), key=lambda item: -item[1]):
+            print(f"        {count:>6}  {route}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /handle_task against local fake GitHub and LLM servers")
+    parser.add_argument("--tasks", type=int, default=20, help="tasks per round")
+    parser.add_argument("--concurrency", type=int, default=5, help="tasks in flight at once")
+    parser.add_argument("--rounds", default="1,2", help="comma separated rounds to run, in order")
+    parser.add_argument("--github-latency", type=float, default=0.05, help="mean fake GitHub latency in seconds")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mean fake LLM completion time in seconds")
+    parser.add_argument("--github-error-rate", type=float, default=0.0, help="fraction of GitHub calls answered with 502")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of LLM calls answered with 502")
+    parser.add_argument("--pages-build-time", type=float, default=2.0, help="seconds the fake Pages build takes after a push")
+    parser.add_argument("--files", type=int, default=6, help="files per generated app")
+    parser.add_argument("--file-size", type=int, default=4096, help="approximate bytes per generated file")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for main.py")
+    parser.add_argument("--port", type=int, default=18000, help="first of three local ports to use")
+    parser.add_argument("--batch", action="store_true", help="submit each round with one /handle_tasks request")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between /jobs polls")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra environment for main.py")
+    parser.add_argument("--app-log", default=os.devnull, help="file receiving main.py output")
+    parser.add_argument("--json", dest="json_path", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    github = FakeGitHub(args.github_latency, args.github_error_rate, args.pages_build_time)
+    llm = FakeLLM(args.llm_latency, args.llm_error_rate, args.files, args.file_size)
+    github_port, llm_port, app_port = args.port, args.port + 1, args.port + 2
+    start_server(github.app, github_port)
+    start_server(llm.app, llm_port)
+
+    env = dict(os.environ)
+    env.update({
+        "GITHUB_API_URL": f"http://127.0.0.1:{github_port}",
+        "GITHUB_TOKEN": "bench-token",
+        "GITHUB_USERNAME": OWNER,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}",
+        "OPENAI_API_KEY": "bench-key",
+        "SecretKey": SECRET,
+        "LLM_CACHE_PATH": "",
+        "WEB_CONCURRENCY": str(args.workers),
+    })
+    env.update(item.split("=", 1) for item in args.env)
+
+    base_url = f"http://127.0.0.1:{app_port}"
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    state_dir = tempfile.TemporaryDirectory()
+    # Fresh job state so earlier runs are not reported as duplicates
+    env.setdefault("STATE_DB_PATH", os.path.join(state_dir.name, "state.db"))
+    env.setdefault("JOURNAL_DIR", os.path.join(state_dir.name, "journal"))
+    with open(args.app_log, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=app_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        try:
+            wait_for_app(base_url, process)
+            if int(env.get("REPO_POOL_SIZE", "0")) > 0:
+                wait_for_repo_pool(base_url, int(env["REPO_POOL_SIZE"]))
+            tasks = [f"bench-{i:04d}" for i in range(args.tasks)]
+            report = {"config": vars(args), "rounds": []}
+            for round_num in [int(r) for r in args.rounds.split(",")]:
+                github.calls.clear()
+                llm.calls.clear()
+                result = asyncio.run(drive_round(base_url, round_num, tasks, args.concurrency, args.poll_interval,
+                                                 f"http://127.0.0.1:{github_port}/evaluation", args.batch))
+                result["github_calls"] = dict(github.calls)
+                result["github_calls_total"] = sum(github.calls.values())
+                result["github_calls_per_task"] = result["github_calls_total"] / max(len(tasks), 1)
+                result["llm_calls"] = dict(llm.calls)
+                result["llm_calls_total"] = sum(llm.calls.values())
+                report["rounds"].append(result)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            state_dir.cleanup()
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,33 @@
 # dependencies = [
 #   "fastapi[standard]",
 #   "uvicorn",
-#   "requests",
+#   "httpx[http2]",
 # ]
 # ///
 
 import os
-import requests
+import httpx
 import base64
 import time
 import json
-from fastapi import FastAPI
+import uuid
+import random
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import bisect
+import re
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from fastapi import Body, FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 
 # Use this proxy https://aipipe.org/openai/v1 with the correct endpoint
 api_base_url = os.getenv("OPENAI_BASE_URL", "https://aipipe.org/openai/v1")
@@ -24,11 +37,520 @@ api_key = os.getenv("OPENAI_API_KEY")  # Make sure to set your OpenAI API key in
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")  
 GITHUB_USERNAME = os.getenv("GITHUB_USERNAME", "24f1002320") 
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+# "git_data" pushes a whole round as one commit, "contents" uses one PUT per file,
+# "git" commits into a local bare mirror of the repo and sends the round with one git push
+GITHUB_PUSH_MODE = os.getenv("GITHUB_PUSH_MODE", "git_data")
+GIT_MIRROR_DIR = os.getenv("GIT_MIRROR_DIR", "git_mirrors")
+# Remote of each repo for the "git" mode, e.g. file:///srv/git/{repo}.git to push to local repositories
+GIT_REMOTE_URL = os.getenv("GIT_REMOTE_URL", "https://github.com/{owner}/{repo}.git")
+# Mirrors unused for this long are removed, then the least recently used ones until the rest fit in GIT_MIRROR_MAX_BYTES
+GIT_MIRROR_MAX_AGE_SECONDS = int(os.getenv("GIT_MIRROR_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+GIT_MIRROR_MAX_BYTES = int(os.getenv("GIT_MIRROR_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Parallel uploads for the "contents" push mode and retries on SHA conflicts
+GITHUB_PUSH_CONCURRENCY = int(os.getenv("GITHUB_PUSH_CONCURRENCY", "4"))
+GITHUB_PUSH_RETRIES = int(os.getenv("GITHUB_PUSH_RETRIES", "3"))
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# JSON list of OpenAI compatible backends: [{"name", "base_url", "api_key_env", "model"}, ...]
+# Defaults to a single backend at OPENAI_BASE_URL using OPENAI_API_KEY and LLM_MODEL
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+# Backends failing more often than this over their last requests are tried last
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+# Send a second request to the next backend when the first is slower than its p95
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+# Hedge delay until a backend has latency samples
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "30"))
+# "json_schema" asks backends for output matching FILES_SCHEMA, "prompt" relies on the prompt alone
+LLM_OUTPUT_MODE = os.getenv("LLM_OUTPUT_MODE", "prompt")
+# Limits on generated files, anything larger is dropped before it reaches GitHub
+LLM_MAX_FILE_BYTES = int(os.getenv("LLM_MAX_FILE_BYTES", str(1024 * 1024)))
+LLM_MAX_TOTAL_BYTES = int(os.getenv("LLM_MAX_TOTAL_BYTES", str(5 * 1024 * 1024)))
+# Follow-up requests for the files missing from a cut off or malformed response
+LLM_REPAIR_ATTEMPTS = int(os.getenv("LLM_REPAIR_ATTEMPTS", "1"))
+# Bump whenever build_prompt changes so cached generations from old prompts are not reused
+PROMPT_VERSION = "1"
+
+# On-disk cache of parsed LLM generations, set LLM_CACHE_PATH to "" to disable
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Round 2 removes files from the repo that the new generation no longer contains
+ROUND2_DELETE_MISSING = os.getenv("ROUND2_DELETE_MISSING", "false").lower() in ("1", "true", "yes")
+# Never removed by ROUND2_DELETE_MISSING
+PROTECTED_FILES = {"LICENSE"}
+# Round 2 shows the model the current repo files within this many tokens (0 disables)
+ROUND2_CONTEXT_TOKENS = int(os.getenv("ROUND2_CONTEXT_TOKENS", "12000"))
+ROUND2_CONTEXT_FILE_TOKENS = int(os.getenv("ROUND2_CONTEXT_FILE_TOKENS", "4000"))
+
+# Repos whose head, trees, file SHAs and contents are remembered between rounds (0 disables)
+REPO_CACHE_SIZE = int(os.getenv("REPO_CACHE_SIZE", "256"))
+
+# Stream LLM output and push each file as soon as it is complete
+LLM_STREAM = os.getenv("LLM_STREAM", "false").lower() in ("1", "true", "yes")
+
+# Client side pacing of GitHub requests, shared by all jobs
+GITHUB_RATE_LIMIT_PER_SECOND = float(os.getenv("GITHUB_RATE_LIMIT_PER_SECOND", "10"))
+GITHUB_RATE_LIMIT_BURST = int(os.getenv("GITHUB_RATE_LIMIT_BURST", "20"))
+# Requests left untouched in the hourly budget before we wait for the reset
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", "50"))
+GITHUB_RATE_LIMIT_RETRIES = int(os.getenv("GITHUB_RATE_LIMIT_RETRIES", "5"))
+# Give up instead of waiting longer than this for a rate limit to clear
+GITHUB_RATE_LIMIT_MAX_WAIT = float(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT", "900"))
+
+# Shared HTTP client settings, LLM completions get their own (much longer) timeout
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+# Calls in flight at once across all jobs, split between server processes
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+GITHUB_MAX_CONCURRENCY = int(os.getenv("GITHUB_MAX_CONCURRENCY", "16"))
+
+# Number of server processes (also read by uvicorn itself) and of job workers inside each of them
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# SQLite file holding jobs, shared by all processes
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.db")
+# Finished jobs are kept for polling this long before being dropped
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+# How often idle workers look for jobs accepted by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# Running jobs without a heartbeat for JOB_STALE_SECONDS are picked up again, at most JOB_MAX_ATTEMPTS times
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Largest number of tasks accepted by one /handle_tasks request
+BATCH_MAX_TASKS = int(os.getenv("BATCH_MAX_TASKS", "500"))
+# Progress events are written to the job store in batches this often, and read by /jobs/{id}/events this often
+JOB_EVENTS_FLUSH_INTERVAL = float(os.getenv("JOB_EVENTS_FLUSH_INTERVAL", "0.1"))
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.25"))
+# Comment lines sent on idle event streams so proxies don't close them
+JOB_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("JOB_EVENTS_KEEPALIVE_SECONDS", "15"))
+# Completed stages and generated files of unfinished jobs, so restarts resume them ("" disables)
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+# Track the Pages build after each round and report readiness in the job and to evaluation_url
+PAGES_WAIT = os.getenv("PAGES_WAIT", "false").lower() in ("1", "true", "yes")
+PAGES_WAIT_TIMEOUT = float(os.getenv("PAGES_WAIT_TIMEOUT", "600"))
+# Polling starts at PAGES_POLL_INITIAL seconds and doubles up to PAGES_POLL_MAX
+PAGES_POLL_INITIAL = float(os.getenv("PAGES_POLL_INITIAL", "2"))
+PAGES_POLL_MAX = float(os.getenv("PAGES_POLL_MAX", "30"))
+# Round 2 and retried jobs are claimed before new round 1 jobs
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+# Placeholder repos kept created and Pages-enabled for round 1 (0 disables the pool)
+REPO_POOL_SIZE = int(os.getenv("REPO_POOL_SIZE", "0"))
+REPO_POOL_PREFIX = os.getenv("REPO_POOL_PREFIX", "pool-")
+# Unused pool repos older than this are deleted and replaced
+REPO_POOL_MAX_AGE_SECONDS = int(os.getenv("REPO_POOL_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+REPO_POOL_REFILL_SECONDS = float(os.getenv("REPO_POOL_REFILL_SECONDS", "60"))
+
+class Metrics:
+    """In-process counters and latency histograms, rendered in the Prometheus text format."""
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, list]] = {}
+        # Called with (stage, seconds, ok) when a timed stage starts (seconds None) and ends
+        self.stage_listeners: list = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        # Per-bucket (non cumulative) counts, then sum and count
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+    @contextmanager
+    def timed(self, stage: str):
+        for listener in self.stage_listeners:
+            listener(stage, None, True)
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except Exception:
+            ok = False
+            self.inc("errors_total", stage=stage)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe("stage_duration_seconds", seconds, stage=stage)
+            for listener in self.stage_listeners:
+                listener(stage, seconds, ok)
+
+    def quantile(self, q: float, counts: list[int], total: int) -> float:
+        # Linear interpolation inside the bucket holding the q-th observation, like histogram_quantile()
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.BUCKETS):
+                    return self.BUCKETS[-1]
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                return lower + (self.BUCKETS[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+    def render(self, gauges: dict[str, dict[tuple, float]] | None = None) -> str:
+        def series_name(name: str, key: tuple, extra: tuple = ()) -> str:
+            labels = ",".join(f'{k}="{v}"' for k, v in key + extra)
+            return f"{self.prefix}_{name}{{{labels}}}" if labels else f"{self.prefix}_{name}"
+
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            lines.extend(f"{series_name(name, key)} {value}" for key, value in sorted(series.items()))
+
+        for name, series in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.extend(f"{series_name(name, key)} {value}" for key, value in sorted(series.items()))
+
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for key, (counts, total_seconds, total) in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{series_name(name + '_bucket', key, (('le', bound),))} {cumulative}")
+                lines.append(f"{series_name(name + '_sum', key)} {total_seconds}")
+                lines.append(f"{series_name(name + '_count', key)} {total}")
+
+            # p50/p95/p99 estimated from the buckets, for readers without a Prometheus server
+            quantile_name = name.removesuffix("_seconds") + "_quantile_seconds"
+            lines.append(f"# TYPE {self.prefix}_{quantile_name} gauge")
+            for key, (counts, _, total) in sorted(series.items()):
+                for q in self.QUANTILES:
+                    value = self.quantile(q, counts, total)
+                    lines.append(f"{series_name(quantile_name, key, (('quantile', q),))} {value:.4f}")
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics("captcha_agent")
+
+# Job whose progress is being reported, set by the worker and inherited by the tasks it starts
+current_job_id: ContextVar[str | None] = ContextVar("current_job_id", default=None)
+# Progress events not yet written to the job store, in the order they happened
+pending_job_events: list[tuple] = []
+
+def emit_job_event(event: str, job_id: str | None = None, **data):
+    job_id = job_id or current_job_id.get()
+    if job_id is not None:
+        pending_job_events.append((job_id, time.time(), event, json.dumps(data)))
+
+# Timed once per file, the file events carry these timings instead
+PER_FILE_STAGES = {"create_blob", "put_file", "delete_file", "sha_lookup"}
+
+def stage_event(stage: str, seconds: float | None, ok: bool):
+    if stage in PER_FILE_STAGES:
+        return
+    if seconds is None:
+        emit_job_event("stage", stage=stage, state="started")
+    else:
+        emit_job_event("stage", stage=stage, state="finished" if ok else "failed", seconds=round(seconds, 3))
+
+metrics.stage_listeners.append(stage_event)
+
+http_client: httpx.AsyncClient | None = None
+
+def create_http_client() -> httpx.AsyncClient:
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    # Normally created on startup, created lazily when used outside the app
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
+
+class GitHubRateLimiter:
+    """Token bucket shared by every job, paced by the rate limit headers GitHub sends back."""
+
+    def __init__(self, rate: float, burst: int, reserve: int, max_wait: float):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        # Last values reported by GitHub
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        # Set from Retry-After or secondary rate limit responses, pauses every job
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.rate_limited = 0
+
+    def current_rate(self, now: float) -> float:
+        # Spread what is left of the budget over the time until it resets
+        if self.remaining is None or not self.reset_at or self.reset_at <= now:
+            return self.rate
+        budget_rate = (self.remaining - self.reserve) / (self.reset_at - now)
+        return max(min(self.rate, budget_rate), 0.01)
+
+    def pause_for(self, now: float) -> float:
+        wait = self.blocked_until - now
+        if self.remaining is not None and self.remaining <= self.reserve and self.reset_at and self.reset_at > now:
+            wait = max(wait, self.reset_at - now)
+        return wait
+
+    async def acquire(self):
+        throttled = False
+        has_token = False
+        while True:
+            async with self.lock:
+                now = time.time()
+                wait = self.pause_for(now)
+                if wait > self.max_wait:
+                    raise Exception(f"GitHub rate limit exhausted for another {wait:.0f}s, longer than the {self.max_wait:.0f}s we wait")
+                if wait <= 0:
+                    if has_token:
+                        return
+                    monotonic_now = time.monotonic()
+                    rate = self.current_rate(now)
+                    self.tokens = min(self.burst, self.tokens + (monotonic_now - self.refilled_at) * rate)
+                    self.refilled_at = monotonic_now
+                    # Take the token even if it isn't there yet, so waiters are served in the order they came
+                    self.tokens -= 1
+                    self.requests += 1
+                    has_token = True
+                    if self.tokens >= 0:
+                        return
+                    wait = -self.tokens / rate
+
+            if not throttled:
+                throttled = True
+                self.throttled += 1
+            # Sleep without the lock so a pause doesn't hold up the max_wait check of other callers
+            await asyncio.sleep(wait + random.uniform(0, 0.1 * wait))
+
+    def update(self, response: httpx.Response):
+        headers = response.headers
+        if "x-ratelimit-remaining" in headers:
+            self.remaining = int(headers["x-ratelimit-remaining"])
+        if "x-ratelimit-limit" in headers:
+            self.limit = int(headers["x-ratelimit-limit"])
+        if "x-ratelimit-reset" in headers:
+            self.reset_at = float(headers["x-ratelimit-reset"])
+
+    def backoff(self, response: httpx.Response, attempt: int) -> float | None:
+        # Seconds to wait before retrying, or None if the response is not a rate limit
+        if response.status_code not in [403, 429]:
+            return None
+
+        now = time.time()
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        elif response.headers.get("x-ratelimit-remaining") == "0" and self.reset_at:
+            delay = max(self.reset_at - now, 1.0)
+        elif response.status_code == 429 or "rate limit" in response.text.lower():
+            # Secondary rate limits without Retry-After: wait at least a minute, then back off exponentially
+            delay = 60.0 * (2 ** attempt)
+        else:
+            return None
+
+        delay += random.uniform(0, min(delay, 10.0))
+        self.blocked_until = max(self.blocked_until, now + delay)
+        self.rate_limited += 1
+        return delay
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "tokens": round(max(min(self.burst, self.tokens + (time.monotonic() - self.refilled_at) * self.current_rate(now)), 0.0), 2),
+            "burst": self.burst,
+            "rate_per_second": round(self.current_rate(now), 3),
+            "configured_rate_per_second": self.rate,
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reserve": self.reserve,
+            "reset_in_seconds": round(self.reset_at - now, 1) if self.reset_at else None,
+            "paused_for_seconds": round(max(self.pause_for(now), 0.0), 1),
+            "requests": self.requests,
+            "throttled_requests": self.throttled,
+            "rate_limited_responses": self.rate_limited,
+        }
+
+# Each process gets its share of the configured pace, GitHub's own counters are global anyway
+github_rate_limiter = GitHubRateLimiter(
+    GITHUB_RATE_LIMIT_PER_SECOND / WEB_CONCURRENCY,
+    max(1, GITHUB_RATE_LIMIT_BURST // WEB_CONCURRENCY),
+    GITHUB_RATE_LIMIT_RESERVE,
+    GITHUB_RATE_LIMIT_MAX_WAIT,
+)
+
+class ConcurrencyLimit:
+    """Caps how many calls of one kind are in flight and records how long callers waited for a slot."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.semaphore: asyncio.Semaphore | None = None
+        self.in_flight = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        metrics.observe("slot_wait_seconds", time.perf_counter() - start, kind=self.name)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting}
+
+llm_limit = ConcurrencyLimit("llm", max(1, LLM_MAX_CONCURRENCY // WEB_CONCURRENCY))
+github_limit = ConcurrencyLimit("github", max(1, GITHUB_MAX_CONCURRENCY // WEB_CONCURRENCY))
+
+async def github_request(method: str, path: str, **kwargs) -> httpx.Response:
+    headers = {
+        "Authorization": f"Bearer {GITHUB_TOKEN}",
+        "Accept": "application/vnd.github+json"
+    }
+    headers.update(kwargs.pop("headers", {}))
+
+    for attempt in range(GITHUB_RATE_LIMIT_RETRIES + 1):
+        await github_rate_limiter.acquire()
+        async with github_limit.slot():
+            start = time.perf_counter()
+            response = await get_http_client().request(method, f"{GITHUB_API_URL}{path}", headers=headers, **kwargs)
+        metrics.observe("github_request_duration_seconds", time.perf_counter() - start, method=method)
+        metrics.inc("github_requests_total", method=method, status=response.status_code)
+        github_rate_limiter.update(response)
+
+        delay = github_rate_limiter.backoff(response, attempt)
+        if delay is None or attempt == GITHUB_RATE_LIMIT_RETRIES or delay > GITHUB_RATE_LIMIT_MAX_WAIT:
+            return response
+        # The limiter holds back every job until the delay has passed
+        metrics.inc("retries_total", reason="rate_limit")
+        print(f"GitHub rate limit hit on {method} {path} ({response.status_code}), retrying in {delay:.1f}s")
+
+    return response
+
+class RepoMetadata:
+    """What we last saw of one repo. Git objects never change, so only the head and per-path lookups carry ETags."""
+
+    # Trees kept per repo, the current one and a few before it
+    MAX_TREES = 4
+
+    def __init__(self):
+        self.head: str | None = None
+        self.head_etag: str | None = None
+        # Listing of main read without knowing its commit, and its ETag
+        self.main_tree: str | None = None
+        self.main_tree_etag: str | None = None
+        # commit SHA -> tree SHA, tree SHA -> blob entries (path, sha, size), blob SHA -> text
+        self.commit_trees: dict[str, str] = {}
+        self.trees: dict[str, list[dict]] = {}
+        self.contents: dict[str, str] = {}
+        # path -> (ETag, blob SHA) from the contents API
+        self.paths: dict[str, tuple[str, str]] = {}
+        self.pages_etag: str | None = None
+        self.pages_build: dict | None = None
+
+    def add_tree(self, commit_sha: str | None, tree_sha: str, blobs: list[dict]):
+        if commit_sha:
+            self.commit_trees[commit_sha] = tree_sha
+        self.trees[tree_sha] = blobs
+        while len(self.trees) > self.MAX_TREES:
+            del self.trees[next(iter(self.trees))]
+        while len(self.commit_trees) > self.MAX_TREES * 4:
+            del self.commit_trees[next(iter(self.commit_trees))]
+        # Contents of files no longer in any kept tree aren't needed any more
+        kept = {item["sha"] for blobs in self.trees.values() for item in blobs}
+        self.contents = {sha: content for sha, content in self.contents.items() if sha in kept}
+
+    def add_contents(self, files: list[dict]):
+        for file in files:
+            self.contents[git_blob_sha(file["content"])] = file["content"]
+
+class RepoMetadataCache:
+    """RepoMetadata per repo name, least recently used repos are dropped past `size`."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.repos: OrderedDict[str, RepoMetadata] = OrderedDict()
+
+    def get(self, repo_name: str) -> RepoMetadata:
+        if self.size <= 0:
+            return RepoMetadata()
+        meta = self.repos.get(repo_name)
+        if meta is None:
+            meta = self.repos[repo_name] = RepoMetadata()
+            while len(self.repos) > self.size:
+                self.repos.popitem(last=False)
+        else:
+            self.repos.move_to_end(repo_name)
+        return meta
+
+    def drop(self, repo_name: str):
+        self.repos.pop(repo_name, None)
+
+repo_cache = RepoMetadataCache(REPO_CACHE_SIZE)
+
+async def conditional_get(path: str, etag: str | None, **kwargs) -> httpx.Response:
+    # 304 answers to If-None-Match don't count against the GitHub rate limit
+    headers = {"If-None-Match": etag} if etag else {}
+    response = await github_request("GET", path, headers=headers, **kwargs)
+    if etag:
+        metrics.inc("github_conditional_requests_total", result="not_modified" if response.status_code == 304 else "modified")
+    return response
 
 def validate_secret(secret: str) -> bool:
     return secret == os.getenv("SecretKey")
 
-def create_github_repo(repo_name: str):
+async def create_github_repo(repo_name: str):
+    with metrics.timed("create_repo"):
+        return await _create_github_repo(repo_name)
+
+async def _create_github_repo(repo_name: str):
     payload = {
         "name": repo_name,
         "private": False,
@@ -36,16 +558,14 @@ def create_github_repo(repo_name: str):
         "license_template": "mit",
     }
     
-    headers = {
-        "Authorization": f"Bearer {GITHUB_TOKEN}", 
-        "Accept": "application/vnd.github+json"
-    }
-    
-    response = requests.post(
-        "https://api.github.com/user/repos",
-        headers=headers,
-        json=payload
-    )
+    response = await github_request("POST", "/user/repos", json=payload)
+
+    if response.status_code == 422 and "already exists" in response.text:
+        # A retried round 1 may find the repository from its earlier attempt
+        existing = await github_request("GET", f"/repos/{GITHUB_USERNAME}/{repo_name}")
+        if existing.status_code == 200:
+            print(f"Repository {repo_name} already exists, reusing it")
+            return existing.json()
     
     if response.status_code != 201:
         raise Exception(f"Failed to create repository '{repo_name}'. Status code: {response.status_code}. Response: {response.text}")
@@ -53,12 +573,10 @@ def create_github_repo(repo_name: str):
         print(f"Successfully created repository: {repo_name}")
         return response.json()
 
-def enable_github_pages(repo_name: str):
+async def enable_github_pages(repo_name: str):
     if not GITHUB_USERNAME:
         raise Exception("GITHUB_USERNAME environment variable is not set.")
         
-    url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/pages"
-    
     payload = {
         "source": {
             "branch": "main",
@@ -66,13 +584,9 @@ def enable_github_pages(repo_name: str):
         }
     }
     
-    headers = {
-        "Authorization": f"Bearer {GITHUB_TOKEN}", 
-        "Accept": "application/vnd.github+json"
-    }
-
     print(f"Enabling GitHub Pages for: {repo_name}")
-    response = requests.post(url, headers=headers, json=payload)
+    with metrics.timed("enable_pages"):
+        response = await github_request("POST", f"/repos/{GITHUB_USERNAME}/{repo_name}/pages", json=payload)
 
     if response.status_code not in [201, 204]:
         if response.status_code == 409:
@@ -81,58 +595,182 @@ def enable_github_pages(repo_name: str):
         raise Exception(f"Failed to enable GitHub Pages. Status: {response.status_code}. Response: {response.text}")
     else:
         print(f"GitHub Pages enabled successfully for {repo_name}.")
-        return response.json()
+        return response.json() if response.content else None
+
+async def read_head(repo_name: str) -> str | None:
+    """Commit main points to, None for an empty repository."""
+    meta = repo_cache.get(repo_name)
+    response = await conditional_get(f"/repos/{GITHUB_USERNAME}/{repo_name}/git/ref/heads/main", meta.head_etag)
+    if response.status_code == 304 and meta.head:
+        return meta.head
+    if response.status_code in [404, 409]:
+        return None
+    if response.status_code != 200:
+        raise Exception(f"Failed to read refs/heads/main. Status: {response.status_code}. Response: {response.text}")
+    meta.head = response.json()["object"]["sha"]
+    meta.head_etag = response.headers.get("ETag")
+    return meta.head
+
+async def get_head_sha(repo_name: str) -> str:
+    head = await read_head(repo_name)
+    if head is None:
+        raise Exception(f"Failed to read refs/heads/main of {repo_name}, the repository is empty")
+    return head
 
-def get_sha_of_latest_commit(repo_name: str, file_path: str):
+async def get_commit_tree(repo_name: str, commit_sha: str) -> str:
+    meta = repo_cache.get(repo_name)
+    if commit_sha not in meta.commit_trees:
+        response = await github_request("GET", f"/repos/{GITHUB_USERNAME}/{repo_name}/git/commits/{commit_sha}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to read commit {commit_sha}. Status: {response.status_code}. Response: {response.text}")
+        meta.commit_trees[commit_sha] = response.json()["tree"]["sha"]
+    return meta.commit_trees[commit_sha]
+
+async def wait_for_pages(repo_name: str, commit_sha: str, timeout: float = PAGES_WAIT_TIMEOUT) -> str:
+    """Polls the latest Pages build until it has published commit_sha, returns built, errored or timeout."""
+    meta = repo_cache.get(repo_name)
+    delay = PAGES_POLL_INITIAL
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await conditional_get(f"/repos/{GITHUB_USERNAME}/{repo_name}/pages/builds/latest", meta.pages_etag)
+        metrics.inc("pages_polls_total", status=response.status_code)
+        if response.status_code == 200:
+            meta.pages_etag = response.headers.get("ETag")
+            meta.pages_build = response.json()
+        elif response.status_code not in [304, 404]:
+            print(f"Failed to read Pages build for {repo_name}. Status: {response.status_code}. Response: {response.text}")
+
+        build = meta.pages_build
+        if build and build.get("commit") == commit_sha and build.get("status") in ("built", "errored"):
+            return build["status"]
+        if time.monotonic() + delay > deadline:
+            return "timeout"
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, PAGES_POLL_MAX)
+
+async def get_sha_of_latest_commit(repo_name: str, file_path: str):
     if not GITHUB_USERNAME:
         return None
 
-    url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/{file_path}?ref=main"
-    
-    headers = {
-        "Authorization": f"Bearer {GITHUB_TOKEN}", 
-        "Accept": "application/vnd.github+json"
-    }
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        return response.json().get('sha')
+    meta = repo_cache.get(repo_name)
+    etag, sha = meta.paths.get(file_path, (None, None))
+    with metrics.timed("sha_lookup"):
+        response = await conditional_get(f"/repos/{GITHUB_USERNAME}/{repo_name}/contents/{file_path}", etag, params={"ref": "main"})
+
+    if response.status_code == 304:
+        return sha
+    elif response.status_code == 200:
+        sha = response.json().get('sha')
+        if response.headers.get("ETag"):
+            meta.paths[file_path] = (response.headers["ETag"], sha)
+        return sha
     elif response.status_code == 404:
+        meta.paths.pop(file_path, None)
         return None
     else:
         raise Exception(f"Failed to get file SHA. Status: {response.status_code}. Response: {response.text}")
 
-def push_files_to_repo(repo_name: str, files: list[dict], round_num: int):
-    if not GITHUB_USERNAME:
-        raise Exception("GITHUB_USERNAME environment variable is not set.")
+async def list_repo_blobs(repo_name: str) -> list[dict] | None:
+    # One recursive tree listing instead of a contents GET per file, reused while main stays on the same tree
+    meta = repo_cache.get(repo_name)
+    with metrics.timed("sha_listing"):
+        head = None
+        tree_ref = "main"
+        if meta.head:
+            # Seen or pushed before, a conditional read of main tells whether the listing we have is still current
+            head = await read_head(repo_name)
+            if head is None:
+                # Empty repository, nothing to update yet
+                return []
+            tree_ref = await get_commit_tree(repo_name, head)
+            if tree_ref in meta.trees:
+                metrics.inc("repo_cache_total", kind="tree", result="hit")
+                return meta.trees[tree_ref]
+        etag = meta.main_tree_etag if tree_ref == "main" and meta.main_tree in meta.trees else None
+        response = await conditional_get(f"/repos/{GITHUB_USERNAME}/{repo_name}/git/trees/{tree_ref}", etag, params={"recursive": "1"})
+        if response.status_code == 304:
+            metrics.inc("repo_cache_total", kind="tree", result="hit")
+            return meta.trees[meta.main_tree]
+        metrics.inc("repo_cache_total", kind="tree", result="miss")
 
-    headers = {
-        "Authorization": f"Bearer {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github+json"
-    }
+    if response.status_code in [404, 409]:
+        return []
+    if response.status_code != 200:
+        raise Exception(f"Failed to list repository tree. Status: {response.status_code}. Response: {response.text}")
 
-    for file in files:
-        file_name = file.get("name")
-        file_content = file.get("content")
+    tree = response.json()
+    if tree.get("truncated"):
+        # Too many entries for one listing
+        return None
+    blobs = [
+        {"path": item["path"], "sha": item["sha"], "size": item.get("size", 0)}
+        for item in tree.get("tree", [])
+        if item.get("type") == "blob"
+    ]
+    meta.add_tree(head, tree["sha"], blobs)
+    if tree_ref == "main":
+        meta.main_tree = tree["sha"]
+        meta.main_tree_etag = response.headers.get("ETag")
+    return blobs
 
-        if not file_name or file_content is None:
-            print(f"Skipping file due to missing name or content: {file}")
-            continue
+async def get_file_shas(repo_name: str) -> dict[str, str] | None:
+    blobs = await list_repo_blobs(repo_name)
+    if blobs is None:
+        # Look SHAs up per file instead
+        return None
+    return {item["path"]: item["sha"] for item in blobs}
 
-        # Base64 encode the content
-        encoded_content = base64.b64encode(file_content.encode("utf-8")).decode("utf-8")
-        
+async def get_blob_content(repo_name: str, sha: str) -> str | None:
+    meta = repo_cache.get(repo_name)
+    if sha in meta.contents:
+        metrics.inc("repo_cache_total", kind="blob", result="hit")
+        return meta.contents[sha]
+    metrics.inc("repo_cache_total", kind="blob", result="miss")
+    response = await github_request("GET", f"/repos/{GITHUB_USERNAME}/{repo_name}/git/blobs/{sha}")
+    if response.status_code != 200:
+        raise Exception(f"Failed to read blob {sha}. Status: {response.status_code}. Response: {response.text}")
+    try:
+        content = base64.b64decode(response.json()["content"]).decode("utf-8")
+    except UnicodeDecodeError:
+        # Images and other binary files are no use in a prompt
+        return None
+    meta.contents[sha] = content
+    return content
+
+async def load_repo_files(repo_name: str) -> list[dict] | None:
+    """Current text files on main, smallest first, or None if the repo can't be listed."""
+    with metrics.timed("load_repo_files"):
+        blobs = await list_repo_blobs(repo_name)
+        if blobs is None:
+            return None
+        # Nothing larger than the whole budget is worth downloading, it gets cut down anyway
+        max_size = max(ROUND2_CONTEXT_TOKENS, ROUND2_CONTEXT_FILE_TOKENS) * 4 * 4
+        blobs = sorted(
+            (item for item in blobs if item["path"] not in PROTECTED_FILES and item.get("size", 0) <= max_size),
+            key=lambda item: item.get("size", 0),
+        )
+        contents = await asyncio.gather(*(get_blob_content(repo_name, item["sha"]) for item in blobs))
+    return [
+        {"name": item["path"], "content": content}
+        for item, content in zip(blobs, contents)
+        if content is not None
+    ]
+
+async def put_file_contents(repo_name: str, file: dict, round_num: int, current_sha: str | None):
+    file_name = file["name"]
+
+    # Base64 encode the content
+    encoded_content = base64.b64encode(file["content"].encode("utf-8")).decode("utf-8")
+    started = time.perf_counter()
+
+    for attempt in range(GITHUB_PUSH_RETRIES + 1):
         # Prepare payload
         payload = {
             "message": f"Add/Update {file_name} for Round {round_num}",
             "content": encoded_content,
-            "branch": "main" 
+            "branch": "main"
         }
 
-        # Always get SHA for the file
-        current_sha = get_sha_of_latest_commit(repo_name, file_path=file_name)
-        
         if current_sha:
             payload["sha"] = current_sha
             print(f"File {file_name} exists, updating with SHA: {current_sha[:8]}...")
@@ -140,46 +778,1108 @@ def push_files_to_repo(repo_name: str, files: list[dict], round_num: int):
             print(f"File {file_name} is new, creating without SHA")
 
         # Push the file
-        url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/{file_name}"
         print(f"Pushing file: {file_name}")
+        with metrics.timed("put_file"):
+            response = await github_request("PUT", f"/repos/{GITHUB_USERNAME}/{repo_name}/contents/{file_name}", json=payload)
 
-        response = requests.put(url, headers=headers, json=payload)
-
-        if response.status_code not in [200, 201]:
-            raise Exception(f"Failed to push file '{file_name}'. Status: {response.status_code}, Response: {response.text}")
-        else:
+        if response.status_code in [200, 201]:
             action = "Updated" if response.status_code == 200 else "Created"
             print(f"File '{file_name}' {action} successfully!")
+            emit_job_event("file", name=file_name, state="pushed", seconds=round(time.perf_counter() - started, 3))
+            repo_cache.get(repo_name).add_contents([file])
+            return
 
-def generate_code(prompt: str) -> str:
-    api_base_url = os.getenv("OPENAI_BASE_URL", "https://aipipe.org/openai/v1")
-    api_key = os.getenv("OPENAI_API_KEY")
-    
-    if not api_key:
-        raise Exception("OPENAI_API_KEY environment variable is not set")
-    
-    if not api_base_url.endswith("/chat/completions"):
-        api_url = f"{api_base_url}/chat/completions"
-    else:
-        api_url = api_base_url
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
+        # 409: the branch moved under us (parallel PUTs), 422: the file appeared without us knowing its SHA
+        if response.status_code in [409, 422] and attempt < GITHUB_PUSH_RETRIES:
+            print(f"SHA conflict pushing '{file_name}' (status {response.status_code}), retrying...")
+            metrics.inc("retries_total", reason="sha_conflict")
+            await asyncio.sleep(0.5 * (attempt + 1) + random.random() * 0.5)
+            current_sha = await get_sha_of_latest_commit(repo_name, file_path=file_name)
+            continue
+
+        raise Exception(f"Failed to push file '{file_name}'. Status: {response.status_code}, Response: {response.text}")
+
+async def iterate_files(files: list[dict]):
+    for file in files:
+        yield file
+
+def is_valid_file(file) -> bool:
+    if not isinstance(file, dict) or not file.get("name") or file.get("content") is None:
+        print(f"Skipping file due to missing name or content: {file}")
+        return False
+    return True
+
+def git_blob_sha(content: str) -> str:
+    # Same SHA GitHub reports for a file, lets us skip uploads of unchanged content
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def is_unchanged(file: dict, known_shas: dict[str, str] | None) -> bool:
+    return known_shas is not None and known_shas.get(file["name"]) == git_blob_sha(file["content"])
+
+def missing_files(known_shas: dict[str, str] | None, files: list[dict]) -> list[str]:
+    if known_shas is None:
+        return []
+    names = {file["name"] for file in files}
+    return sorted(path for path in known_shas if path not in names and path not in PROTECTED_FILES)
+
+async def delete_file_contents(repo_name: str, path: str, current_sha: str, round_num: int):
+    payload = {
+        "message": f"Remove {path} for Round {round_num}",
+        "sha": current_sha,
+        "branch": "main"
+    }
+    started = time.perf_counter()
+    with metrics.timed("delete_file"):
+        response = await github_request("DELETE", f"/repos/{GITHUB_USERNAME}/{repo_name}/contents/{path}", json=payload)
+    if response.status_code != 200:
+        raise Exception(f"Failed to delete file '{path}'. Status: {response.status_code}, Response: {response.text}")
+    emit_job_event("file", name=path, state="deleted", seconds=round(time.perf_counter() - started, 3))
+    print(f"File '{path}' deleted successfully!")
+
+async def push_files_with_contents_api(repo_name: str, file_stream, round_num: int, known_shas_task: asyncio.Task | None = None) -> list[dict]:
+    semaphore = asyncio.Semaphore(GITHUB_PUSH_CONCURRENCY)
+
+    async def push_file(file: dict):
+        known_shas = await known_shas_task
+        async with semaphore:
+            if known_shas is None:
+                current_sha = await get_sha_of_latest_commit(repo_name, file_path=file["name"])
+            else:
+                current_sha = known_shas.get(file["name"])
+            await put_file_contents(repo_name, file, round_num, current_sha)
+
+    # Start each upload as soon as its file arrives
+    files = []
+    tasks = []
+    async for file in file_stream:
+        if known_shas_task is None:
+            # Listed once the first file is ready, so a repo set up meanwhile is already there
+            known_shas_task = asyncio.create_task(get_file_shas(repo_name))
+        files.append(file)
+        tasks.append(asyncio.create_task(push_file(file)))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise errors[0]
+    return files
+
+async def delete_files_with_contents_api(repo_name: str, paths: list[str], known_shas: dict[str, str], round_num: int):
+    # One at a time, after the uploads, so deletions don't race each other on main
+    for path in paths:
+        await delete_file_contents(repo_name, path, known_shas[path], round_num)
+
+async def create_blob(repo_name: str, content: str) -> str:
+    with metrics.timed("create_blob"):
+        response = await github_request(
+            "POST",
+            f"/repos/{GITHUB_USERNAME}/{repo_name}/git/blobs",
+            json={"content": content, "encoding": "utf-8"},
+        )
+    if response.status_code != 201:
+        raise Exception(f"Failed to create blob. Status: {response.status_code}. Response: {response.text}")
+    return response.json()["sha"]
+
+async def upload_blob(repo_name: str, file: dict) -> str:
+    started = time.perf_counter()
+    sha = await create_blob(repo_name, file["content"])
+    repo_cache.get(repo_name).add_contents([file])
+    emit_job_event("file", name=file["name"], state="uploaded", seconds=round(time.perf_counter() - started, 3))
+    return sha
+
+def emit_unchanged_files(names: list[str]):
+    for name in names:
+        emit_job_event("file", name=name, state="unchanged")
+
+def emit_committed_files(files: list[dict], deleted: list[str], seconds: float):
+    # Everything in one commit lands together, so each file gets the time the commit took
+    for file in files:
+        emit_job_event("file", name=file["name"], state="pushed", seconds=round(seconds, 3))
+    for path in deleted:
+        emit_job_event("file", name=path, state="deleted", seconds=round(seconds, 3))
+
+async def commit_tree(repo_name: str, tree: list[dict], message: str) -> str:
+    with metrics.timed("commit_tree"):
+        return await _commit_tree(repo_name, tree, message)
+
+async def _commit_tree(repo_name: str, tree: list[dict], message: str) -> str:
+    repo_path = f"/repos/{GITHUB_USERNAME}/{repo_name}"
+
+    # Current head of main and the tree it points to
+    parent_sha = await get_head_sha(repo_name)
+    base_tree_sha = await get_commit_tree(repo_name, parent_sha)
+
+    response = await github_request("POST", f"{repo_path}/git/trees", json={"base_tree": base_tree_sha, "tree": tree})
+    if response.status_code != 201:
+        raise Exception(f"Failed to create tree. Status: {response.status_code}. Response: {response.text}")
+    tree_sha = response.json()["sha"]
+
+    commit_payload = {
+        "message": message,
+        "tree": tree_sha,
+        "parents": [parent_sha],
+    }
+    response = await github_request("POST", f"{repo_path}/git/commits", json=commit_payload)
+    if response.status_code != 201:
+        raise Exception(f"Failed to create commit. Status: {response.status_code}. Response: {response.text}")
+    commit_sha = response.json()["sha"]
+
+    response = await github_request("PATCH", f"{repo_path}/git/refs/heads/main", json={"sha": commit_sha})
+    if response.status_code != 200:
+        raise Exception(f"Failed to update refs/heads/main. Status: {response.status_code}. Response: {response.text}")
+
+    remember_head(repo_name, commit_sha, response.headers.get("ETag"))
+    remember_commit(repo_name, base_tree_sha, tree, commit_sha, tree_sha)
+    return commit_sha
+
+def remember_head(repo_name: str, commit_sha: str, etag: str | None):
+    # Still revalidated before use, someone else may push after us. The old ETag would only ever miss,
+    # the one of our ref update matches the next read when GitHub sends one
+    meta = repo_cache.get(repo_name)
+    meta.head = commit_sha
+    meta.head_etag = etag
+
+def remember_commit(repo_name: str, base_tree_sha: str, tree: list[dict], commit_sha: str, tree_sha: str):
+    # The new tree is the base tree with our entries applied, so round 2 doesn't have to list or download it
+    meta = repo_cache.get(repo_name)
+    meta.commit_trees[commit_sha] = tree_sha
+    inline = [{"name": entry["path"], "content": entry["content"]} for entry in tree if "content" in entry]
+    meta.add_contents(inline)
+    base = meta.trees.get(base_tree_sha)
+    if base is None:
+        return
+    blobs = {item["path"]: item for item in base}
+    for entry in tree:
+        if "content" in entry:
+            sha = git_blob_sha(entry["content"])
+            blobs[entry["path"]] = {"path": entry["path"], "sha": sha, "size": len(entry["content"].encode("utf-8"))}
+        elif entry["sha"] is None:
+            blobs.pop(entry["path"], None)
+        else:
+            size = len(meta.contents[entry["sha"]].encode("utf-8")) if entry["sha"] in meta.contents else 0
+            blobs[entry["path"]] = {"path": entry["path"], "sha": entry["sha"], "size": size}
+    meta.add_tree(commit_sha, tree_sha, sorted(blobs.values(), key=lambda item: item["path"]))
+
+def commit_message(files: list[dict], round_num: int, deleted: list[str] = ()) -> str:
+    names = ", ".join(file["name"] for file in files)
+    message = f"Add/Update {len(files)} files for Round {round_num}\n\n{names}"
+    if deleted:
+        message += f"\n\nRemoved: {', '.join(deleted)}"
+    return message
+
+def deletion_entries(deleted: list[str]) -> list[dict]:
+    # A null SHA removes the path from the base tree
+    return [{"path": path, "mode": "100644", "type": "blob", "sha": None} for path in deleted]
+
+async def push_files_with_git_data_api(repo_name: str, files: list[dict], round_num: int, deleted: list[str] = ()):
+    # One tree with every file inlined, so GitHub creates the blobs for us
+    tree = [
+        {"path": file["name"], "mode": "100644", "type": "blob", "content": file["content"]}
+        for file in files
+    ]
+    tree += deletion_entries(deleted)
+    started = time.perf_counter()
+    commit_sha = await commit_tree(repo_name, tree, commit_message(files, round_num, deleted))
+    emit_committed_files(files, deleted, time.perf_counter() - started)
+    print(f"Pushed {len(files)} files to {repo_name} in commit {commit_sha[:8]}")
+    return commit_sha
+
+def git_remote_url(repo_name: str) -> str:
+    return GIT_REMOTE_URL.format(owner=GITHUB_USERNAME, repo=repo_name)
+
+def git_env() -> dict[str, str]:
+    env = {
+        **os.environ,
+        "GIT_TERMINAL_PROMPT": "0",
+        "GIT_AUTHOR_NAME": GITHUB_USERNAME,
+        "GIT_AUTHOR_EMAIL": f"{GITHUB_USERNAME}@users.noreply.github.com",
+        "GIT_COMMITTER_NAME": GITHUB_USERNAME,
+        "GIT_COMMITTER_EMAIL": f"{GITHUB_USERNAME}@users.noreply.github.com",
     }
+    if GITHUB_TOKEN and GIT_REMOTE_URL.startswith("https://"):
+        # Passed through the environment so the token shows up neither in the URL nor in the process list
+        credentials = base64.b64encode(f"x-access-token:{GITHUB_TOKEN}".encode()).decode()
+        env.update(GIT_CONFIG_COUNT="1", GIT_CONFIG_KEY_0="http.extraHeader", GIT_CONFIG_VALUE_0=f"Authorization: Basic {credentials}")
+    return env
+
+async def run_git(*args: str, git_dir: str | None = None, input: bytes | None = None, env: dict | None = None) -> tuple[int, str, str]:
+    command = ["git", f"--git-dir={git_dir}", *args] if git_dir else ["git", *args]
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**git_env(), **(env or {})},
+    )
+    stdout, stderr = await process.communicate(input)
+    return process.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+
+async def git(*args: str, git_dir: str | None = None, input: bytes | None = None, env: dict | None = None) -> str:
+    returncode, stdout, stderr = await run_git(*args, git_dir=git_dir, input=input, env=env)
+    if returncode != 0:
+        raise Exception(f"git {args[0]} failed ({returncode}): {stderr.strip()}")
+    return stdout
+
+# Mirrors being pushed from right now, never evicted
+git_mirrors_in_use: set[str] = set()
+
+async def fetch_git_mirror(path: str, repo_name: str) -> str | None:
+    # Only the tip of main, the history is never needed to add a commit on top of it
+    with metrics.timed("git_fetch"):
+        returncode, _, stderr = await run_git("fetch", "--depth=1", "--quiet", git_remote_url(repo_name),
+                                              "+refs/heads/main:refs/heads/main", git_dir=path)
+    if returncode != 0:
+        if "couldn't find remote ref" in stderr:
+            # Empty repository, the first push creates main
+            return None
+        raise Exception(f"git fetch failed ({returncode}): {stderr.strip()}")
+    return await git_mirror_head(path)
+
+async def git_remote_head(repo_name: str) -> str | None:
+    # One round trip without any objects, None for an empty repository
+    with metrics.timed("git_ls_remote"):
+        stdout = await git("ls-remote", git_remote_url(repo_name), "refs/heads/main")
+    return stdout.split()[0] if stdout.strip() else None
+
+async def git_mirror_head(path: str) -> str | None:
+    returncode, stdout, _ = await run_git("rev-parse", "--verify", "--quiet", "refs/heads/main", git_dir=path)
+    return stdout.strip() if returncode == 0 else None
+
+async def git_tree_shas(path: str, commit: str | None) -> dict[str, str]:
+    if commit is None:
+        return {}
+    listing = await git("ls-tree", "-r", "--full-tree", "-z", commit, git_dir=path)
+    shas = {}
+    for entry in filter(None, listing.split("\0")):
+        info, name = entry.split("\t", 1)
+        _, kind, sha = info.split()
+        if kind == "blob":
+            shas[name] = sha
+    return shas
+
+def write_blob_files(directory: str, files: list[dict]) -> list[str]:
+    paths = []
+    for i, file in enumerate(files):
+        path = os.path.join(directory, f"blob{i}")
+        with open(path, "wb") as f:
+            f.write(file["content"].encode("utf-8"))
+        paths.append(path)
+    return paths
+
+async def commit_to_git_mirror(path: str, parent: str | None, files: list[dict], deleted: list[str], message: str) -> str:
+    # Plumbing against a throwaway index, the bare mirror never gets a working tree
+    with metrics.timed("git_commit"), tempfile.TemporaryDirectory() as tmp:
+        env = {"GIT_INDEX_FILE": os.path.join(tmp, "index")}
+        if parent:
+            await git("read-tree", parent, git_dir=path, env=env)
+        blob_paths = await asyncio.to_thread(write_blob_files, tmp, files)
+        shas = (await git("hash-object", "-w", "--stdin-paths", git_dir=path, input="\n".join(blob_paths).encode())).split()
+        index_info = "".join(f"100644 {sha}\t{file['name']}\n" for file, sha in zip(files, shas))
+        # Mode 0 removes the path from the index
+        index_info += "".join(f"0 {'0' * 40}\t{name}\n" for name in deleted)
+        await git("update-index", "--index-info", git_dir=path, env=env, input=index_info.encode("utf-8"))
+        tree = (await git("write-tree", git_dir=path, env=env)).strip()
+        parents = ["-p", parent] if parent else []
+        return (await git("commit-tree", tree, *parents, "-m", message, git_dir=path)).strip()
+
+async def push_files_with_git(repo_name: str, files: list[dict], round_num: int, only_changed: bool, delete_missing: bool) -> dict:
+    path = os.path.join(GIT_MIRROR_DIR, f"{repo_name}.git")
+    git_mirrors_in_use.add(path)
+    try:
+        if not os.path.isdir(path):
+            await git("init", "--quiet", "--bare", path)
+            try:
+                head = await fetch_git_mirror(path, repo_name)
+            except Exception:
+                # Not worth keeping, e.g. the remote doesn't exist
+                await asyncio.to_thread(shutil.rmtree, path, True)
+                raise
+        else:
+            # Mirrors are evicted least recently used first
+            os.utime(path)
+            head = await git_mirror_head(path)
+            # Behind whenever someone else pushed or a failed git push fell back to the git data API,
+            # and diffing against a stale tree could skip files the remote no longer has
+            if await git_remote_head(repo_name) != head:
+                head = await fetch_git_mirror(path, repo_name)
+
+        # Fetched again if main moves on between here and the push
+        started = time.perf_counter()
+        for attempt in range(2):
+            known_shas = await git_tree_shas(path, head)
+            pushed = [file for file in files if not (only_changed and is_unchanged(file, known_shas))]
+            unchanged = [file["name"] for file in files if only_changed and is_unchanged(file, known_shas)]
+            deleted = missing_files(known_shas, files) if delete_missing else []
+            if not pushed and not deleted:
+                print("No changes to push")
+                emit_unchanged_files(unchanged)
+                return push_summary(files, pushed, unchanged, deleted)
+
+            commit = await commit_to_git_mirror(path, head, pushed, deleted, commit_message(pushed, round_num, deleted))
+            with metrics.timed("git_push"):
+                returncode, _, stderr = await run_git("push", "--quiet", git_remote_url(repo_name),
+                                                      f"{commit}:refs/heads/main", git_dir=path)
+            if returncode == 0:
+                await git("update-ref", "refs/heads/main", commit, git_dir=path)
+                break
+            if attempt == 0 and ("rejected" in stderr or "fetch first" in stderr):
+                print(f"main of {repo_name} moved on, fetching it and committing again")
+                metrics.inc("retries_total", reason="git_push_rejected")
+                head = await fetch_git_mirror(path, repo_name)
+                continue
+            raise Exception(f"git push failed ({returncode}): {stderr.strip()}")
+    finally:
+        git_mirrors_in_use.discard(path)
+
+    repo_cache.get(repo_name).add_contents(pushed)
+    remember_head(repo_name, commit, None)
+    emit_unchanged_files(unchanged)
+    emit_committed_files(pushed, deleted, time.perf_counter() - started)
+    print(f"Pushed {len(pushed)} files to {repo_name} in commit {commit[:8]} with git")
+    await asyncio.to_thread(evict_git_mirrors, GIT_MIRROR_DIR)
+    return push_summary(files, pushed, unchanged, deleted)
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def evict_git_mirrors(directory: str):
+    # Unused mirrors past their age, then the least recently used ones while over the disk quota
+    if not os.path.isdir(directory):
+        return
+    mirrors = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and path not in git_mirrors_in_use:
+            try:
+                mirrors.append((os.path.getmtime(path), directory_size(path), path))
+            except OSError:
+                # Evicted by another process meanwhile
+                pass
+    mirrors.sort()
+    total = sum(size for _, size, _ in mirrors)
+    cutoff = time.time() - GIT_MIRROR_MAX_AGE_SECONDS
+    for used_at, size, path in mirrors:
+        if used_at >= cutoff and total <= GIT_MIRROR_MAX_BYTES:
+            break
+        try:
+            shutil.rmtree(path)
+            print(f"Evicted git mirror {path}")
+        except OSError as e:
+            print(f"Failed to evict git mirror {path}: {e}")
+        total -= size
+
+def push_summary(files: list[dict], pushed: list[dict], unchanged: list[str], deleted: list[str]) -> dict:
+    if unchanged:
+        print(f"Skipped {len(unchanged)} unchanged files: {', '.join(unchanged)}")
+    emit_job_event("pushed", files=len(files), pushed=len(pushed), unchanged=len(unchanged), deleted=len(deleted))
+    return {
+        "files": files,
+        "pushed": [file["name"] for file in pushed],
+        "unchanged": unchanged,
+        "deleted": deleted,
+    }
+
+async def push_file_stream(repo_name: str, file_stream, round_num: int, only_changed: bool = False, delete_missing: bool = False) -> dict:
+    with metrics.timed("push"):
+        return await _push_file_stream(repo_name, file_stream, round_num, only_changed, delete_missing)
+
+async def _push_file_stream(repo_name: str, file_stream, round_num: int, only_changed: bool, delete_missing: bool) -> dict:
+    if not GITHUB_USERNAME:
+        raise Exception("GITHUB_USERNAME environment variable is not set.")
+
+    if GITHUB_PUSH_MODE == "git":
+        # A single push carries the whole round, so it waits for every file
+        files = []
+        async for file in file_stream:
+            if is_valid_file(file):
+                emit_job_event("file", name=file["name"], state="generated", bytes=len(file["content"]))
+                files.append(file)
+        return await _push_files_to_repo(repo_name, files, round_num, only_changed, delete_missing)
+
+    # The current tree is listed while the first files are still being generated
+    known_shas_task = None
+    if only_changed or delete_missing:
+        known_shas_task = asyncio.create_task(get_file_shas(repo_name))
+
+    files = []
+    unchanged = []
+
+    async def changed_files():
+        async for file in file_stream:
+            if not is_valid_file(file):
+                continue
+            files.append(file)
+            if only_changed and is_unchanged(file, await known_shas_task):
+                unchanged.append(file["name"])
+                emit_job_event("file", name=file["name"], state="unchanged")
+                continue
+            emit_job_event("file", name=file["name"], state="generated", bytes=len(file["content"]))
+            yield file
+
+    if GITHUB_PUSH_MODE != "git_data":
+        pushed = await push_files_with_contents_api(repo_name, changed_files(), round_num, known_shas_task)
+        deleted = []
+        if delete_missing:
+            known_shas = await known_shas_task
+            deleted = missing_files(known_shas, files)
+            await delete_files_with_contents_api(repo_name, deleted, known_shas, round_num)
+        return push_summary(files, pushed, unchanged, deleted)
+
+    # Upload each blob while the rest of the files are still being generated
+    pushed = []
+    blob_tasks = []
+    async for file in changed_files():
+        print(f"Uploading blob for {file['name']}")
+        pushed.append(file)
+        blob_tasks.append(asyncio.create_task(upload_blob(repo_name, file)))
+
+    deleted = missing_files(await known_shas_task, files) if delete_missing else []
+    if not pushed and not deleted:
+        print("No changes to push")
+        return push_summary(files, pushed, unchanged, deleted)
+
+    try:
+        blob_shas = await asyncio.gather(*blob_tasks)
+        tree = [
+            {"path": file["name"], "mode": "100644", "type": "blob", "sha": sha}
+            for file, sha in zip(pushed, blob_shas)
+        ]
+        tree += deletion_entries(deleted)
+        started = time.perf_counter()
+        commit_sha = await commit_tree(repo_name, tree, commit_message(pushed, round_num, deleted))
+        emit_committed_files(pushed, deleted, time.perf_counter() - started)
+        print(f"Pushed {len(pushed)} files to {repo_name} in commit {commit_sha[:8]}")
+        return push_summary(files, pushed, unchanged, deleted)
+    except Exception as e:
+        print(f"Batched push failed, falling back to per-file push: {e}")
+
+    await push_files_with_contents_api(repo_name, iterate_files(pushed), round_num, known_shas_task)
+    if deleted:
+        await delete_files_with_contents_api(repo_name, deleted, await known_shas_task, round_num)
+    return push_summary(files, pushed, unchanged, deleted)
+
+async def push_files_to_repo(repo_name: str, files: list[dict], round_num: int, only_changed: bool = False, delete_missing: bool = False) -> dict:
+    with metrics.timed("push"):
+        return await _push_files_to_repo(repo_name, files, round_num, only_changed, delete_missing)
+
+async def _push_files_to_repo(repo_name: str, files: list[dict], round_num: int, only_changed: bool, delete_missing: bool) -> dict:
+    if not GITHUB_USERNAME:
+        raise Exception("GITHUB_USERNAME environment variable is not set.")
+
+    valid_files = [file for file in files if is_valid_file(file)]
+    if GITHUB_PUSH_MODE == "git":
+        try:
+            return await push_files_with_git(repo_name, valid_files, round_num, only_changed, delete_missing)
+        except Exception as e:
+            print(f"Git push failed, falling back to the Git Data API: {e}")
+
+    pushed = valid_files
+    unchanged = []
+    deleted = []
+
+    known_shas_task = None
+    if only_changed or delete_missing:
+        # One tree listing tells us which files actually differ from main
+        known_shas_task = asyncio.create_task(get_file_shas(repo_name))
+        known_shas = await known_shas_task
+        if only_changed:
+            pushed = [file for file in valid_files if not is_unchanged(file, known_shas)]
+            unchanged = [file["name"] for file in valid_files if is_unchanged(file, known_shas)]
+        if delete_missing:
+            deleted = missing_files(known_shas, valid_files)
+        emit_unchanged_files(unchanged)
+
+    if not pushed and not deleted:
+        print("No changes to push")
+        return push_summary(valid_files, pushed, unchanged, deleted)
+
+    if GITHUB_PUSH_MODE in ("git_data", "git"):
+        try:
+            await push_files_with_git_data_api(repo_name, pushed, round_num, deleted)
+            return push_summary(valid_files, pushed, unchanged, deleted)
+        except Exception as e:
+            # e.g. an empty repository has no refs/heads/main yet
+            print(f"Batched push failed, falling back to per-file push: {e}")
+
+    await push_files_with_contents_api(repo_name, iterate_files(pushed), round_num, known_shas_task)
+    if deleted:
+        await delete_files_with_contents_api(repo_name, deleted, await known_shas_task, round_num)
+    return push_summary(valid_files, pushed, unchanged, deleted)
+
+class LLMBackend:
+    """One OpenAI compatible chat completions endpoint and its recent latency and errors."""
+
+    WINDOW = 50
+
+    def __init__(self, name: str, base_url: str, api_key_env: str, model: str):
+        self.name = name
+        self.url = base_url if base_url.endswith("/chat/completions") else f"{base_url.rstrip('/')}/chat/completions"
+        self.api_key_env = api_key_env
+        self.model = model
+        self.latencies = deque(maxlen=self.WINDOW)
+        self.outcomes = deque(maxlen=self.WINDOW)
+        # Time spent before losing a hedge race, only a lower bound on how long the request would have taken
+        self.cancelled = deque(maxlen=self.WINDOW)
+        # Cleared when the backend rejects response_format, it then gets the plain prompt
+        self.structured_output = LLM_OUTPUT_MODE == "json_schema"
+
+    def headers(self) -> dict:
+        api_key = os.getenv(self.api_key_env)
+        if not api_key:
+            raise Exception(f"{self.api_key_env} environment variable is not set")
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    def record(self, ok: bool, seconds: float):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(seconds)
+
+    def record_cancelled(self, seconds: float):
+        # Lost a hedge race: not an error, and not a latency either since it never finished
+        self.cancelled.append(seconds)
+
+    def rank_key(self) -> tuple:
+        # Untried backends first, then by median latency, then those that only ever lost races
+        if self.latencies:
+            return (not self.healthy(), 1, self.latency(0.5))
+        if self.cancelled:
+            return (not self.healthy(), 2, max(self.cancelled))
+        return (not self.healthy(), 0, 0.0)
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def latency(self, q: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def healthy(self) -> bool:
+        # A few failures in a row are enough to look elsewhere first
+        return len(self.outcomes) < 3 or self.error_rate() < LLM_MAX_ERROR_RATE
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "structured_output": self.structured_output,
+            "healthy": self.healthy(),
+            "requests": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_seconds": self.latency(0.5),
+            "p95_seconds": self.latency(0.95),
+            "cancelled": len(self.cancelled),
+        }
+
+class LLMRouter:
+    """Sends each completion to the fastest healthy backend, optionally hedging with the next one."""
+
+    def __init__(self, backends: list[LLMBackend]):
+        self.backends = backends
+
+    def ranked(self) -> list[LLMBackend]:
+        # Healthy before unhealthy, then see rank_key
+        return sorted(self.backends, key=lambda backend: backend.rank_key())
+
+    def hedge_delay(self, backend: LLMBackend) -> float:
+        return backend.latency(0.95) or LLM_HEDGE_DELAY
+
+    async def complete(self, prompt: str) -> str:
+        backends = self.ranked()
+        pending = {}
+        errors = []
+
+        def launch():
+            backend = backends[len(errors) + len(pending)]
+            pending[asyncio.create_task(request_completion(backend, prompt))] = (backend, time.perf_counter())
+
+        launch()
+        try:
+            while pending:
+                # Hedge once the backend in flight has taken longer than its usual p95
+                can_hedge = LLM_HEDGE and len(pending) == 1 and len(errors) + len(pending) < len(backends)
+                timeout = self.hedge_delay(next(iter(pending.values()))[0]) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    metrics.inc("llm_hedges_total")
+                    launch()
+                    continue
+                for task in done:
+                    pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors.append(e)
+                if not pending and len(errors) < len(backends):
+                    # Fail over to the next backend
+                    launch()
+            raise errors[-1]
+        finally:
+            # Recorded here rather than in the task, so the next request already ranks the loser accordingly
+            for task, (backend, started) in pending.items():
+                task.cancel()
+                backend.record_cancelled(time.perf_counter() - started)
+
+    async def stream(self, prompt: str):
+        # Streams aren't hedged, but a backend that fails before its first chunk is skipped
+        backends = self.ranked()
+        for i, backend in enumerate(backends):
+            started = False
+            try:
+                async for content in stream_completion(backend, prompt):
+                    started = True
+                    yield content
+                return
+            except Exception as e:
+                if started or i == len(backends) - 1:
+                    raise
+                print(f"LLM backend {backend.name} failed, trying {backends[i + 1].name}: {e}")
+
+def load_llm_backends() -> list[LLMBackend]:
+    if not LLM_BACKENDS:
+        return [LLMBackend("default", api_base_url, "OPENAI_API_KEY", LLM_MODEL)]
+    return [
+        LLMBackend(item["name"], item["base_url"], item.get("api_key_env", "OPENAI_API_KEY"), item.get("model", LLM_MODEL))
+        for item in json.loads(LLM_BACKENDS)
+    ]
+
+llm_router = LLMRouter(load_llm_backends())
+
+def record_token_usage(usage: dict | None):
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage and usage.get(kind):
+            metrics.inc("llm_tokens_total", usage[kind], type=kind.removesuffix("_tokens"))
+
+# Strict schemas need an object at the top level, the parsers find the array inside it
+FILES_SCHEMA = {
+    "name": "files",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "files": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "content": {"type": "string"},
+                    },
+                    "required": ["name", "content"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["files"],
+        "additionalProperties": False,
+    },
+}
+
+def completion_payload(backend: LLMBackend, prompt: str) -> dict:
     data = {
-        "model": "gpt-4o",
+        "model": backend.model,
         "messages": [{"role": "user", "content": prompt}],
     }
-    
-    response = requests.post(api_url, headers=headers, json=data)    
+    if backend.structured_output:
+        data["response_format"] = {"type": "json_schema", "json_schema": FILES_SCHEMA}
+    return data
+
+def rejects_structured_output(backend: LLMBackend, data: dict, response: httpx.Response) -> bool:
+    if response.status_code != 400 or "response_format" not in data:
+        return False
+    print(f"LLM backend {backend.name} rejected response_format, using the plain prompt: {response.text}")
+    backend.structured_output = False
+    metrics.inc("llm_structured_output_fallbacks_total", backend=backend.name)
+    return True
+
+async def request_completion(backend: LLMBackend, prompt: str) -> str:
+    data = completion_payload(backend, prompt)
+
+    async with llm_limit.slot():
+        start = time.perf_counter()
+        try:
+            response = await get_http_client().post(backend.url, headers=backend.headers(), json=data, timeout=LLM_TIMEOUT)
+        except Exception:
+            backend.record(False, time.perf_counter() - start)
+            raise
+    metrics.inc("llm_requests_total", backend=backend.name, status=response.status_code)
+    if rejects_structured_output(backend, data, response):
+        return await request_completion(backend, prompt)
+    backend.record(response.status_code == 200, time.perf_counter() - start)
     if response.status_code == 200:
         result = response.json()
+        record_token_usage(result.get("usage"))
         return result['choices'][0]['message']['content']
     else:
-        raise Exception(f"Request failed with status code {response.status_code}: {response.text}")
+        raise Exception(f"Request to {backend.name} failed with status code {response.status_code}: {response.text}")
+
+async def generate_code(prompt: str) -> str:
+    with metrics.timed("llm_generate"):
+        return await llm_router.complete(prompt)
+
+async def stream_completion(backend: LLMBackend, prompt: str):
+    data = completion_payload(backend, prompt)
+    data.update(stream=True, stream_options={"include_usage": True})
+
+    retry = False
+    async with llm_limit.slot():
+        start = time.perf_counter()
+        ok = False
+        try:
+            async with get_http_client().stream("POST", backend.url, headers=backend.headers(), json=data, timeout=LLM_TIMEOUT) as response:
+                metrics.inc("llm_requests_total", backend=backend.name, status=response.status_code)
+                if response.status_code != 200:
+                    await response.aread()
+                    retry = rejects_structured_output(backend, data, response)
+                    if not retry:
+                        raise Exception(f"Request to {backend.name} failed with status code {response.status_code}: {response.text}")
+                else:
+                    # Server-sent events, one "data: {...}" line per chunk
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        payload = line[5:].strip()
+                        if payload == "[DONE]":
+                            break
+                        chunk = json.loads(payload)
+                        record_token_usage(chunk.get("usage"))
+                        for choice in chunk.get("choices", []):
+                            content = (choice.get("delta") or {}).get("content")
+                            if content:
+                                yield content
+                    ok = True
+        finally:
+            if not retry:
+                backend.record(ok, time.perf_counter() - start)
+
+    if retry:
+        async for content in stream_completion(backend, prompt):
+            yield content
+
+def stream_code(prompt: str):
+    return llm_router.stream(prompt)
+
+class FileStreamParser:
+    """Pulls complete {"name", "content"} objects out of a JSON array as it streams in."""
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.current = []
+
+    def feed(self, text: str) -> list[dict]:
+        files = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.started:
+                # Skip markdown fences or any text before the array
+                self.started = char == "["
+                continue
+            if self.depth == 0:
+                if char == "{":
+                    self.depth = 1
+                    self.current = [char]
+                elif char == "]":
+                    self.finished = True
+                elif not char.isspace() and char != ",":
+                    # A bracket in the surrounding prose, keep looking for the array
+                    self.started = False
+                continue
+
+            self.current.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        # strict=False accepts raw newlines and tabs inside strings
+                        files.append(json.loads("".join(self.current), strict=False))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping unparseable file object from LLM stream: {e}")
+                    self.current = []
+        return files
 
-def write_code_using_llm(task_brief: str, round_num: int = 1, feedback: str = ""):
+    def partial_name(self) -> str | None:
+        """Name of the object that was cut off, if the stream stopped inside one."""
+        if self.depth == 0:
+            return None
+        match = re.search(r'"name"\s*:\s*"((?:[^"\\]|\\.)*)"', "".join(self.current))
+        return json.loads(f'"{match.group(1)}"') if match else None
+
+def parse_llm_files(text: str) -> tuple[list[dict], bool, str | None]:
+    """Files in an LLM response, whether the array was complete, and the name of a file that was cut off."""
+    # Fast path: a well formed array, possibly wrapped in fences or prose
+    start = re.search(r"\[\s*\{", text)
+    if start:
+        try:
+            files, _ = json.JSONDecoder(strict=False).raw_decode(text, start.start())
+            return files, True, None
+        except json.JSONDecodeError:
+            pass
+    # Otherwise keep every complete object, e.g. from a response cut off at the token limit
+    parser = FileStreamParser()
+    files = parser.feed(text)
+    return files, parser.finished, parser.partial_name()
+
+class GeneratedFiles:
+    """Validated files of one generation, dropping unsafe paths, oversized content and repeats."""
+
+    def __init__(self):
+        self.files: dict[str, dict] = {}
+        self.total_bytes = 0
+
+    def add(self, file) -> dict | None:
+        if not isinstance(file, dict):
+            print(f"Skipping non-object entry from LLM: {str(file)[:100]}")
+            return None
+        name, content = file.get("name"), file.get("content")
+        if isinstance(content, (dict, list)):
+            # e.g. package.json given as an object instead of a string
+            content = json.dumps(content, indent=2)
+        if not isinstance(name, str) or not isinstance(content, str):
+            print(f"Skipping file with missing name or content: {str(file)[:100]}")
+            return None
+
+        name = name.strip().removeprefix("./")
+        parts = name.split("/")
+        if not name or name.startswith("/") or "\\" in name or ":" in name or ".." in parts or parts[0] == ".git" or len(name) > 255:
+            print(f"Skipping file with unsafe path: {name!r}")
+            return None
+        if name in self.files:
+            print(f"Skipping repeated file: {name}")
+            return None
+        size = len(content.encode("utf-8"))
+        if size > LLM_MAX_FILE_BYTES or self.total_bytes + size > LLM_MAX_TOTAL_BYTES:
+            print(f"Skipping {name}: {size} bytes is over the size limit")
+            return None
+
+        self.total_bytes += size
+        self.files[name] = {"name": name, "content": content}
+        return self.files[name]
+
+    def list(self) -> list[dict]:
+        return list(self.files.values())
+
+def continuation_prompt(prompt: str, received: list[str], truncated_name: str | None) -> str:
+    cut_off = f" while writing {truncated_name}" if truncated_name else ""
+    first = f", starting with the complete {truncated_name}" if truncated_name else ""
+    return f"""{prompt}
+        
+        Your previous answer was cut off{cut_off}.
+        These files arrived complete, do not repeat them: {", ".join(received) or "none"}.
+        Return ONLY a JSON array with the remaining files{first}.
+        """
+
+async def complete_missing_files(prompt: str, collected: GeneratedFiles, truncated_name: str | None) -> tuple[list[dict], bool]:
+    # Ask only for what is missing instead of regenerating everything
+    new_files = []
+    finished = False
+    for attempt in range(LLM_REPAIR_ATTEMPTS):
+        metrics.inc("llm_repairs_total")
+        print(f"LLM response incomplete, asking for the remaining files (attempt {attempt + 1})")
+        response = await generate_code(continuation_prompt(prompt, list(collected.files), truncated_name))
+        files, finished, truncated_name = parse_llm_files(response)
+        new_files.extend(file for file in map(collected.add, files) if file is not None)
+        if finished:
+            break
+    return new_files, finished
+
+class GenerationCache:
+    """SQLite cache of LLM generations with a TTL and least-recently-used eviction by total size."""
+
+    def __init__(self, path: str, ttl_seconds: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used_at)")
+        self.conn.commit()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now - self.ttl_seconds:
+                if row is not None:
+                    self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self.evict(now)
+            self.conn.commit()
+
+    def evict(self, now: float):
+        cursor = self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self.evictions += cursor.rowcount
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+generation_cache: GenerationCache | None = None
+
+def get_generation_cache() -> GenerationCache | None:
+    global generation_cache
+    if generation_cache is None and LLM_CACHE_PATH:
+        generation_cache = GenerationCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_BYTES)
+    return generation_cache
+
+def generation_cache_key(prompt: str) -> str:
+    # Any configured backend may answer, so a generation is only reused with the same models and output mode
+    key_data = json.dumps({
+        "models": [backend.model for backend in llm_router.backends],
+        "output_mode": LLM_OUTPUT_MODE,
+        "prompt_version": PROMPT_VERSION,
+        "prompt": prompt,
+    }, sort_keys=True)
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+async def get_cached_files(prompt: str) -> list[dict] | None:
+    cache = get_generation_cache()
+    if cache is None:
+        return None
+    try:
+        cached = await asyncio.to_thread(cache.get, generation_cache_key(prompt))
+    except Exception as e:
+        # e.g. "database is locked" with several processes, generate instead
+        metrics.inc("errors_total", stage="llm_cache")
+        print(f"LLM cache lookup failed: {e}")
+        return None
+    if cached is None:
+        metrics.inc("llm_cache_lookups_total", result="miss")
+        return None
+    metrics.inc("llm_cache_lookups_total", result="hit")
+    print("LLM cache hit, reusing previous generation")
+    return json.loads(cached)
+
+async def cache_files(prompt: str, files: list[dict]):
+    cache = get_generation_cache()
+    if cache is None:
+        return
+    try:
+        await asyncio.to_thread(cache.set, generation_cache_key(prompt), json.dumps(files))
+    except Exception as e:
+        metrics.inc("errors_total", stage="llm_cache")
+        print(f"Failed to cache LLM generation: {e}")
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for code and English
+    return len(text) // 4 + 1
+
+def truncate_to_tokens(content: str, max_tokens: int) -> str:
+    """Keep the start and end of a file, dropping whole lines from the middle."""
+    if estimate_tokens(content) <= max_tokens:
+        return content
+    lines = content.splitlines()
+    # Leave room for the marker line
+    chars = max(max_tokens * 4 - 40, 0)
+    head_chars = chars * 2 // 3
+    tail_chars = chars // 3
+    head, tail = [], []
+    size = 0
+    for line in lines:
+        size += len(line) + 1
+        if size > head_chars:
+            break
+        head.append(line)
+    size = 0
+    for line in reversed(lines[len(head):]):
+        size += len(line) + 1
+        if size > tail_chars:
+            break
+        tail.insert(0, line)
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"... [{omitted} lines omitted] ..."] + tail)
+
+def build_repo_context(files: list[dict], budget: int) -> str:
+    sections = []
+    omitted = []
+    for file in files:
+        # Later files get whatever the earlier ones left over
+        allowance = min(ROUND2_CONTEXT_FILE_TOKENS, budget)
+        if allowance < 200:
+            omitted.append(file["name"])
+            continue
+        content = truncate_to_tokens(file["content"], allowance)
+        note = "" if content == file["content"] else " (truncated)"
+        sections.append(f"--- {file['name']}{note} ---\n{content}")
+        budget -= estimate_tokens(content)
+    if omitted:
+        sections.append(f"Other files, not shown: {', '.join(omitted)}")
+    return "\n\n".join(sections)
+
+def build_prompt(task_brief: str, round_num: int = 1, feedback: str = "", existing_files: list[dict] | None = None) -> str:
     if round_num == 1:
         prompt = f"""
         Create a complete web application for: {task_brief}
@@ -216,6 +1916,27 @@ def write_code_using_llm(task_brief: str, round_num: int = 1, feedback: str = ""
         
         Make sure the code is complete and runnable.
         """
+    elif existing_files:
+        context = build_repo_context(existing_files, ROUND2_CONTEXT_TOKENS)
+        prompt = f"""
+        Based on this feedback: {feedback}
+        
+        Improve and fix the existing code for: {task_brief}
+        
+        These are the current files in the repository:
+        
+{context}
+        
+        Return ONLY the files that need to change, each with its complete new content.
+        Files you do not return are kept exactly as they are, so leave out files that already work.
+        Only return a file marked as truncated if you rewrite all of it.
+        
+        Return ONLY a JSON array where each object has:
+        - "name": filename (e.g., "index.html")
+        - "content": the complete file content
+        
+        Make sure all issues from the feedback are resolved.
+        """
     else:
         prompt = f"""
         Based on this feedback: {feedback}
@@ -231,40 +1952,109 @@ def write_code_using_llm(task_brief: str, round_num: int = 1, feedback: str = ""
         
         Make sure all issues from the feedback are resolved.
         """
+    return prompt
+
+async def write_code_using_llm(task_brief: str, round_num: int = 1, feedback: str = "", existing_files: list[dict] | None = None):
+    prompt = build_prompt(task_brief, round_num, feedback, existing_files)
+
+    cached_files = await get_cached_files(prompt)
+    if cached_files is not None:
+        return cached_files
     
+    llm_response = ""
     try:
-        llm_response = generate_code(prompt)
+        llm_response = await generate_code(prompt)
         print("LLM Response received, parsing...")
         
-        # Parse the JSON response from LLM
-        # Sometimes LLM adds markdown code blocks, so we need to clean it
-        cleaned_response = llm_response.strip()
-        if cleaned_response.startswith('```json'):
-            cleaned_response = cleaned_response[7:]
-        if cleaned_response.endswith('```'):
-            cleaned_response = cleaned_response[:-3]
-        if cleaned_response.startswith('```'):
-            cleaned_response = cleaned_response[3:]
-            
-        files = json.loads(cleaned_response)
-        
-        # Validate the file structure
-        if not isinstance(files, list):
-            raise ValueError("LLM response is not a list")
-            
+        files, finished, truncated_name = parse_llm_files(llm_response)
+        collected = GeneratedFiles()
         for file in files:
-            if "name" not in file or "content" not in file:
-                raise ValueError("Invalid file structure in LLM response")
+            collected.add(file)
+        if not finished:
+            try:
+                _, finished = await complete_missing_files(prompt, collected, truncated_name)
+            except Exception as e:
+                # Keep the files that did arrive complete
+                print(f"Error asking for the remaining files: {e}")
+        if not collected.files:
+            if existing_files and finished:
+                # Asked for the changed files only, an empty array means nothing needs to change
+                print("LLM returned no changed files")
+                await cache_files(prompt, [])
+                return []
+            raise ValueError("No valid files in LLM response")
                 
+        files = collected.list()
         print(f"Successfully parsed {len(files)} files from LLM")
+        # Only cache complete generations
+        if finished:
+            await cache_files(prompt, files)
         return files
         
     except Exception as e:
+        metrics.inc("errors_total", stage="llm_parse")
         print(f"Error parsing LLM response: {e}")
         print(f"Raw LLM response: {llm_response}")
+        if existing_files:
+            # The repo already holds a working app, never replace it with the placeholder
+            raise Exception(f"LLM generation failed: {e}")
         # Fallback to basic files if LLM fails
         return get_fallback_files()
 
+async def stream_files_using_llm(task_brief: str, round_num: int = 1, feedback: str = "", existing_files: list[dict] | None = None):
+    prompt = build_prompt(task_brief, round_num, feedback, existing_files)
+
+    cached_files = await get_cached_files(prompt)
+    if cached_files is not None:
+        for file in cached_files:
+            yield file
+        return
+
+    parser = FileStreamParser()
+    collected = GeneratedFiles()
+    finished = False
+    start = time.perf_counter()
+    try:
+        async for chunk in stream_code(prompt):
+            for file in parser.feed(chunk):
+                file = collected.add(file)
+                if file is None:
+                    continue
+                if len(collected.files) == 1:
+                    metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="llm_first_file")
+                yield file
+        metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="llm_stream")
+        finished = parser.finished
+    except Exception as e:
+        metrics.inc("errors_total", stage="llm_stream")
+        print(f"Error streaming LLM response: {e}")
+
+    if not finished:
+        try:
+            new_files, finished = await complete_missing_files(prompt, collected, parser.partial_name())
+            for file in new_files:
+                yield file
+        except Exception as e:
+            print(f"Error asking for the remaining files: {e}")
+
+    file_count = len(collected.files)
+    if file_count == 0 and existing_files:
+        # The repo already holds a working app, an empty answer means nothing needs to change
+        if not finished:
+            raise Exception("No files parsed from LLM stream")
+        print("LLM returned no changed files")
+        await cache_files(prompt, [])
+    elif file_count == 0:
+        # Fallback to basic files if LLM fails
+        print("No files parsed from LLM stream, using fallback files")
+        for file in get_fallback_files():
+            yield file
+    else:
+        print(f"Successfully streamed {file_count} files from LLM")
+        # Only cache complete generations
+        if finished:
+            await cache_files(prompt, collected.list())
+
 def get_fallback_files():
     """Fallback files in case LLM fails"""
     return [
@@ -526,26 +2316,155 @@ button:hover {
     # return f"https://huggingface.co/spaces/{HF_USERNAME}/{repo_name}"
   
 
-def round1(data):
+class StageJournal:
+    """Append-only record of the stages a job has completed, with its generated files stored alongside,
+    so a job restarted after a crash or redeploy picks up where it stopped."""
+
+    def __init__(self, directory: str | None, key: str):
+        # Without a directory nothing is recorded and every stage runs
+        self.path = None
+        self.files_path = None
+        self.stages: dict[str, dict] = {}
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.files_path = os.path.join(directory, f"{name}.files.json")
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line from a crash mid-write
+                        continue
+                    self.stages[entry["stage"]] = entry
+
+    def done(self, stage: str) -> dict | None:
+        return self.stages.get(stage)
+
+    def record(self, stage: str, **data):
+        if self.path is None:
+            return
+        entry = {"stage": stage, "at": time.time(), **data}
+        self.stages[stage] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save_files(self, files: list[dict], **data):
+        if self.files_path is not None:
+            tmp_path = f"{self.files_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(files, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.files_path)
+        self.record("generated", files=len(files), **data)
+
+    def load_files(self) -> list[dict] | None:
+        if self.done("generated") is None or self.files_path is None or not os.path.exists(self.files_path):
+            return None
+        with open(self.files_path) as f:
+            return json.load(f)
+
+    def remove(self):
+        for path in (self.path, self.files_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+NO_JOURNAL = StageJournal(None, "")
+
+def clean_journal(directory: str):
+    # Journals of jobs that never completed, e.g. failed tasks nobody resubmitted
+    if not directory or not os.path.isdir(directory):
+        return
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            # Another process starting up removed it first
+            pass
+
+async def journal_files(file_stream, journal: StageJournal, **data):
+    # Saved once the stream is complete, before the push commits them
+    files = []
+    async for file in file_stream:
+        files.append(file)
+        yield file
+    await asyncio.to_thread(journal.save_files, files, **data)
+
+async def setup_repo(repo_name: str, journal: StageJournal = NO_JOURNAL) -> dict:
+    # Create repo and enable pages
+    stage = journal.done("repo_created")
+    if stage is not None:
+        repo_info = stage["repo_info"]
+    else:
+        repo_info = await create_github_repo(repo_name)
+        print(f"Repository created: {repo_info.get('html_url', 'N/A')}")
+        await asyncio.to_thread(journal.record, "repo_created", repo_info={"html_url": repo_info.get("html_url", "")})
+
+    if journal.done("pages_enabled") is None:
+        await enable_github_pages(repo_name)
+        print("GitHub Pages configured")
+        await asyncio.to_thread(journal.record, "pages_enabled")
+    return repo_info
+
+async def wait_then_stream(file_stream, ready: asyncio.Task):
+    # Keep reading the LLM stream while the repository is still being set up
+    queue = asyncio.Queue()
+
+    async def read_stream():
+        try:
+            async for file in file_stream:
+                await queue.put(file)
+        finally:
+            await queue.put(None)
+
+    reader = asyncio.create_task(read_stream())
+    # If setup fails the reader still finishes, so the generation ends up in the cache for a retry
+    await ready
+    while (file := await queue.get()) is not None:
+        yield file
+    await reader
+
+async def round1(data, journal: StageJournal = NO_JOURNAL):
     try:
         print("=== STARTING ROUND 1 ===")
         
-        # Use LLM to generate code based on the task brief
         task_brief = data.get('brief', 'Create a captcha solver web application')
-        files_to_push = write_code_using_llm(task_brief, round_num=1)
-        
         repo_name = f"{data['task']}-{data['nonce']}"
         print(f"Repository name: {repo_name}")
 
-        # Create repo and enable pages
-        repo_info = create_github_repo(repo_name)
-        print(f"Repository created: {repo_info.get('html_url', 'N/A')}")
+        # Repo creation and Pages don't depend on the generated files, so run them alongside the LLM
+        setup_task = asyncio.create_task(provision_repo(repo_name, journal))
 
-        pages_info = enable_github_pages(repo_name)
-        print("GitHub Pages configured")
+        files_to_push = await asyncio.to_thread(journal.load_files)
+        if files_to_push is not None:
+            # Generated before a restart, don't pay for the LLM again
+            print(f"Resuming with {len(files_to_push)} generated files from the journal")
+            repo_info = await setup_task
+            if journal.done("pushed") is None:
+                await push_files_to_repo(repo_name, files_to_push, round_num=1)
+        elif LLM_STREAM:
+            file_stream = journal_files(stream_files_using_llm(task_brief, round_num=1), journal)
+            push_result = await push_file_stream(repo_name, wait_then_stream(file_stream, setup_task), round_num=1)
+            files_to_push = push_result["files"]
+            repo_info = await setup_task
+        else:
+            # Use LLM to generate code based on the task brief
+            files_to_push = await write_code_using_llm(task_brief, round_num=1)
+            await asyncio.to_thread(journal.save_files, files_to_push)
+            repo_info = await setup_task
 
-        # Push files to GitHub
-        push_files_to_repo(repo_name, files_to_push, round_num=1)
+            # Push files to GitHub
+            await push_files_to_repo(repo_name, files_to_push, round_num=1)
+        await asyncio.to_thread(journal.record, "pushed")
         print("All files pushed to GitHub successfully")
         
         # Create Hugging Face Space
@@ -568,25 +2487,58 @@ def round1(data):
         print(f"Error during round1 processing: {e}")
         return {"error": str(e)}
 
-def round2(data: dict):
+async def round2(data: dict, journal: StageJournal = NO_JOURNAL):
     try:
         print("=== STARTING ROUND 2 ===")
-        repo_name = f"{data['task']}_{data['nonce']}"
+        repo_name = f"{data['task']}-{data['nonce']}"
         
         # Get feedback from the evaluation
         feedback = data.get("evaluation_feedback", "Fix issues and improve the implementation")
         task_brief = data.get('brief', 'Create a captcha solver web application')
         
-        # Use LLM to generate improved code based on feedback
-        files_to_modify = write_code_using_llm(task_brief, round_num=2, feedback=feedback)
+        generated_files = await asyncio.to_thread(journal.load_files)
+        existing_files = None
+        if ROUND2_CONTEXT_TOKENS > 0 and generated_files is None:
+            try:
+                existing_files = await load_repo_files(repo_name)
+            except Exception as e:
+                print(f"Could not load current repo files, regenerating without them: {e}")
+        if existing_files:
+            print(f"Loaded {len(existing_files)} current files into the prompt")
+        # The model only returns changed files when it has seen the repo, so a missing file is not a deletion
+        delete_missing = ROUND2_DELETE_MISSING and not existing_files
+        
+        if generated_files is not None:
+            # Generated before a restart, don't pay for the LLM again
+            print(f"Resuming with {len(generated_files)} generated files from the journal")
+            push_result = journal.done("pushed")
+            if push_result is None:
+                # Files were only omitted if the model saw the repo, then nothing is deleted
+                delete_missing = ROUND2_DELETE_MISSING and not journal.done("generated").get("context")
+                push_result = await push_files_to_repo(repo_name, generated_files, round_num=2,
+                                                       only_changed=True, delete_missing=delete_missing)
+        elif LLM_STREAM:
+            file_stream = stream_files_using_llm(task_brief, round_num=2, feedback=feedback, existing_files=existing_files)
+            push_result = await push_file_stream(repo_name, journal_files(file_stream, journal, context=bool(existing_files)), round_num=2,
+                                                 only_changed=True, delete_missing=delete_missing)
+        else:
+            # Use LLM to generate improved code based on feedback
+            files_to_modify = await write_code_using_llm(task_brief, round_num=2, feedback=feedback, existing_files=existing_files)
+            await asyncio.to_thread(journal.save_files, files_to_modify, context=bool(existing_files))
+            push_result = await push_files_to_repo(repo_name, files_to_modify, round_num=2,
+                                                   only_changed=True, delete_missing=delete_missing)
+        await asyncio.to_thread(journal.record, "pushed", pushed=push_result["pushed"],
+                                unchanged=push_result["unchanged"], deleted=push_result["deleted"])
         
-        print(f"Updating {len(files_to_modify)} files based on feedback")
-        push_files_to_repo(repo_name, files_to_modify, round_num=2)
+        print(f"Updated {len(push_result['pushed'])} files based on feedback, "
+              f"{len(push_result['unchanged'])} unchanged, {len(push_result['deleted'])} deleted")
         
         return {
             "message": "Round 2 code modification complete", 
             "repo_name": repo_name,
-            "files_updated": len(files_to_modify),
+            "files_updated": len(push_result["pushed"]),
+            "files_unchanged": len(push_result["unchanged"]),
+            "files_deleted": len(push_result["deleted"]),
             "feedback_applied": feedback[:100] + "..." if len(feedback) > 100 else feedback
         }
 
@@ -594,7 +2546,677 @@ def round2(data: dict):
         print(f"Error during round2 processing: {e}")
         return {"error": str(e)}
 
-app = FastAPI(title="Captcha Solver Agent")
+class JobStore:
+    """Jobs in SQLite, shared by every worker process so any of them can accept, run or report a job."""
+
+    COLUMNS = ("id", "key", "status", "round", "task", "nonce", "created_at", "started_at", "finished_at",
+               "heartbeat_at", "worker", "attempts", "data", "result", "priority", "prefix")
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                round INTEGER,
+                task TEXT,
+                nonce TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL,
+                result TEXT,
+                priority INTEGER NOT NULL DEFAULT 1,
+                prefix TEXT
+            )"""
+        )
+        # Databases created before jobs were prioritised
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("priority", "INTEGER NOT NULL DEFAULT 1"), ("prefix", "TEXT")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_prefix ON jobs (status, prefix)")
+        # Progress of each job, read by /jobs/{id}/events from whichever process serves it
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS job_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                at REAL NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS job_events_at ON job_events (at)")
+        # Jobs submitted together through /handle_tasks
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS batch_jobs (
+                batch_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                job_id TEXT NOT NULL,
+                PRIMARY KEY (batch_id, position)
+            )"""
+        )
+
+    def row_to_job(self, row) -> dict:
+        job = dict(zip(self.COLUMNS, row))
+        job["data"] = json.loads(job["data"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def fetch(self, where: str, params: tuple) -> dict | None:
+        row = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE {where}", params).fetchone()
+        return self.row_to_job(row) if row else None
+
+    def expire(self, now: float):
+        if self.conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_TTL_SECONDS,)).rowcount:
+            self.conn.execute("DELETE FROM batch_jobs WHERE job_id NOT IN (SELECT id FROM jobs)")
+        self.conn.execute("DELETE FROM job_events WHERE at < ?", (now - JOB_TTL_SECONDS,))
+
+    def insert(self, data: dict, now: float) -> tuple[dict, bool]:
+        # Returns the job for this (task, nonce, round) and whether it was just created.
+        # Queued, running and completed jobs are reused, failed ones may be retried.
+        key = json.dumps([data.get("task"), data.get("nonce"), data.get("round")])
+        existing = self.fetch("key = ? AND status != 'failed' ORDER BY created_at DESC LIMIT 1", (key,))
+        if existing is not None:
+            return existing, False
+
+        # Round 2 fixes and resubmissions of failed tasks go ahead of new round 1 work
+        retry = self.conn.execute("SELECT 1 FROM jobs WHERE key = ? LIMIT 1", (key,)).fetchone() is not None
+        priority = PRIORITY_HIGH if data.get("round") == 2 or retry else PRIORITY_NORMAL
+
+        job_id = uuid.uuid4().hex
+        # Request payload without the secret, only used by the worker
+        payload = {k: v for k, v in data.items() if k != "secret"}
+        self.conn.execute(
+            "INSERT INTO jobs (id, key, status, round, task, nonce, created_at, data, priority, prefix) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, key, data.get("round"), data.get("task"), data.get("nonce"), now, json.dumps(payload),
+             priority, task_prefix(data.get("task"))),
+        )
+        return self.fetch("id = ?", (job_id,)), True
+
+    def submit(self, data: dict) -> tuple[dict, bool]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.expire(now)
+                submitted = self.insert(data, now)
+                self.conn.execute("COMMIT")
+                return submitted
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def submit_batch(self, tasks: list[dict]) -> tuple[str, list[tuple[dict, bool]]]:
+        # Every task in one transaction, remembered under a batch id for /batches/{batch_id}
+        now = time.time()
+        batch_id = uuid.uuid4().hex
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.expire(now)
+                submitted = [self.insert(data, now) for data in tasks]
+                # Repeated tasks share a job, which is only counted once
+                job_ids = list(dict.fromkeys(job["id"] for job, _ in submitted))
+                self.conn.executemany(
+                    "INSERT INTO batch_jobs (batch_id, position, job_id) VALUES (?, ?, ?)",
+                    [(batch_id, position, job_id) for position, job_id in enumerate(job_ids)],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return batch_id, submitted
+
+    def batch(self, batch_id: str) -> list[dict]:
+        columns = ", ".join(f"jobs.{column}" for column in self.COLUMNS)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {columns} FROM batch_jobs JOIN jobs ON jobs.id = batch_jobs.job_id WHERE batch_id = ? ORDER BY position",
+                (batch_id,),
+            ).fetchall()
+        return [self.row_to_job(row) for row in rows]
+
+    def claim(self, worker: str) -> dict | None:
+        # A queued job, or a running one whose worker stopped sending heartbeats. Retries and high
+        # priority jobs first, then the task prefix with the fewest running jobs, then the oldest.
+        now = time.time()
+        stale_before = now - JOB_STALE_SECONDS
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                job = self.fetch(
+                    """status = 'queued' OR (status = 'running' AND heartbeat_at < ?)
+                    ORDER BY CASE WHEN attempts > 0 THEN 0 ELSE priority END,
+                        (SELECT COUNT(*) FROM jobs AS running
+                         WHERE running.status = 'running' AND running.prefix = jobs.prefix AND running.heartbeat_at >= ?),
+                        created_at
+                    LIMIT 1""",
+                    (stale_before, stale_before),
+                )
+                if job is None:
+                    self.conn.execute("COMMIT")
+                    return None
+
+                if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                    result = {"error": f"Job abandoned after {job['attempts']} attempts"}
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, result = ? WHERE id = ?",
+                        (now, json.dumps(result), job["id"]),
+                    )
+                    self.conn.execute("COMMIT")
+                    return None
+
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, worker = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now, now, worker, job["id"]),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        job.update(status="running", started_at=now, heartbeat_at=now, worker=worker, attempts=job["attempts"] + 1)
+        return job
+
+    def heartbeat(self, job_id: str, worker: str):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ?", (time.time(), job_id, worker))
+
+    def finish(self, job_id: str, worker: str, status: str, result: dict) -> float:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ? WHERE id = ? AND worker = ?",
+                (status, now, json.dumps(result), job_id, worker),
+            )
+        return now
+
+    def get(self, job_id: str) -> dict | None:
+        with self.lock:
+            return self.fetch("id = ?", (job_id,))
+
+    def update_result(self, job_id: str, updates: dict):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is not None:
+                    result = json.loads(row[0]) if row[0] else {}
+                    result.update(updates)
+                    self.conn.execute("UPDATE jobs SET result = ? WHERE id = ?", (json.dumps(result), job_id))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def add_events(self, events: list[tuple]):
+        # (job_id, at, type, data) tuples, written in one transaction
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("INSERT INTO job_events (job_id, at, type, data) VALUES (?, ?, ?, ?)", events)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def events(self, job_id: str, after_id: int = 0, limit: int = 500) -> list[dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, at, type, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (job_id, after_id, limit),
+            ).fetchall()
+        return [{"id": id, "at": at, "type": type, "data": json.loads(data)} for id, at, type, data in rows]
+
+    def counts(self) -> dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def requeue_running(self) -> int:
+        # Only safe when no other process can be working on them
+        with self.lock:
+            return self.conn.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running'").rowcount
+
+    def pending_pages(self) -> list[dict]:
+        # Completed jobs whose Pages build is still being waited for
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT {', '.join(self.COLUMNS)} FROM jobs
+                WHERE status = 'completed' AND json_extract(result, '$.pages_status') = 'pending'"""
+            ).fetchall()
+        return [self.row_to_job(row) for row in rows]
+
+    def expire_pages(self, finished_before: float) -> list[str]:
+        # Pending Pages waits older than any waiter could still be running, marked as timed out
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    """SELECT id FROM jobs WHERE status = 'completed' AND finished_at < ?
+                    AND json_extract(result, '$.pages_status') = 'pending'""",
+                    (finished_before,),
+                ).fetchall()
+                self.conn.executemany(
+                    "UPDATE jobs SET result = json_set(result, '$.pages_status', 'timeout') WHERE id = ?", rows
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [row[0] for row in rows]
+
+    def queue_stats(self) -> dict[int, tuple[int, float]]:
+        # Queued jobs per priority and how long the oldest of them has been waiting
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT priority, COUNT(*), MIN(created_at) FROM jobs WHERE status = 'queued' GROUP BY priority"
+            ).fetchall()
+        return {priority: (count, now - oldest) for priority, count, oldest in rows}
+
+def task_prefix(task: str | None) -> str:
+    # Tasks are named like "captcha-solver-3f2a", the part before the last dash identifies the assignment
+    return (task or "").rsplit("-", 1)[0]
+
+job_store: JobStore | None = None
+# Set when a job is submitted to this process, workers also poll for jobs submitted elsewhere
+job_wakeup: asyncio.Event | None = None
+
+def get_job_store() -> JobStore:
+    global job_store
+    if job_store is None:
+        job_store = JobStore(STATE_DB_PATH)
+    return job_store
+
+async def write_job_events():
+    if not pending_job_events:
+        return
+    batch = pending_job_events[:]
+    del pending_job_events[:]
+    try:
+        await asyncio.to_thread(get_job_store().add_events, batch)
+    except Exception as e:
+        print(f"Failed to write {len(batch)} job events: {e}")
+
+async def flush_job_events():
+    # A single writer, so events reach the store in the order they were emitted
+    while True:
+        await asyncio.sleep(JOB_EVENTS_FLUSH_INTERVAL)
+        await write_job_events()
+
+class RepoPool:
+    """Placeholder repos created and Pages-enabled ahead of time, renamed when a round 1 task arrives."""
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS repo_pool (
+                name TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                claimed_at REAL
+            )"""
+        )
+        # Databases created before claims were timed
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(repo_pool)")}
+        if "claimed_at" not in columns:
+            self.conn.execute("ALTER TABLE repo_pool ADD COLUMN claimed_at REAL")
+
+    def reserve(self, size: int) -> list[str]:
+        # Names to create so the pool reaches `size`, shared between processes so they don't overfill it
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                (count,) = self.conn.execute("SELECT COUNT(*) FROM repo_pool WHERE status IN ('creating', 'ready')").fetchone()
+                names = [f"{REPO_POOL_PREFIX}{uuid.uuid4().hex[:12]}" for _ in range(max(size - count, 0))]
+                now = time.time()
+                self.conn.executemany(
+                    "INSERT INTO repo_pool (name, status, created_at) VALUES (?, 'creating', ?)",
+                    [(name, now) for name in names],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return names
+
+    def mark_ready(self, name: str):
+        with self.lock:
+            self.conn.execute("UPDATE repo_pool SET status = 'ready', created_at = ? WHERE name = ?", (time.time(), name))
+
+    def claim(self) -> str | None:
+        # Oldest ready repo, so none of them sits in the pool long enough to be collected
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self.conn.execute(
+                    "SELECT name FROM repo_pool WHERE status = 'ready' AND created_at > ? ORDER BY created_at LIMIT 1",
+                    (now - REPO_POOL_MAX_AGE_SECONDS,),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE repo_pool SET status = 'claimed', claimed_at = ? WHERE name = ?", (now, row[0]))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row[0] if row else None
+
+    def release(self, name: str):
+        with self.lock:
+            self.conn.execute("UPDATE repo_pool SET status = 'ready' WHERE name = ?", (name,))
+
+    def remove(self, name: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM repo_pool WHERE name = ?", (name,))
+
+    def stale(self) -> list[tuple[str, str]]:
+        # Ready repos past their age, and creations or claims whose process went away mid-way
+        now = time.time()
+        with self.lock:
+            return self.conn.execute(
+                """SELECT name, status FROM repo_pool WHERE (status = 'ready' AND created_at < ?)
+                OR (status = 'creating' AND created_at < ?) OR (status = 'claimed' AND claimed_at < ?)""",
+                (now - REPO_POOL_MAX_AGE_SECONDS, now - 600, now - 600),
+            ).fetchall()
+
+    def counts(self) -> dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM repo_pool GROUP BY status").fetchall()
+        return dict(rows)
+
+repo_pool: RepoPool | None = None
+# Set when a repo is taken from the pool so it is refilled right away
+repo_pool_wakeup: asyncio.Event | None = None
+
+def get_repo_pool() -> RepoPool:
+    global repo_pool
+    if repo_pool is None:
+        repo_pool = RepoPool(STATE_DB_PATH)
+    return repo_pool
+
+async def delete_github_repo(repo_name: str):
+    response = await github_request("DELETE", f"/repos/{GITHUB_USERNAME}/{repo_name}")
+    repo_cache.drop(repo_name)
+    if response.status_code not in [204, 404]:
+        raise Exception(f"Failed to delete repository '{repo_name}'. Status: {response.status_code}. Response: {response.text}")
+    print(f"Deleted repository: {repo_name}")
+
+async def rename_github_repo(repo_name: str, new_name: str) -> dict | None:
+    response = await github_request("PATCH", f"/repos/{GITHUB_USERNAME}/{repo_name}", json={"name": new_name})
+    repo_cache.drop(repo_name)
+    repo_cache.drop(new_name)
+    if response.status_code == 200:
+        return response.json()
+    print(f"Failed to rename {repo_name} to {new_name}. Status: {response.status_code}. Response: {response.text}")
+    return None
+
+async def add_pool_repo(name: str):
+    pool = get_repo_pool()
+    try:
+        await setup_repo(name)
+    except Exception as e:
+        print(f"Failed to create pool repo {name}: {e}")
+        await asyncio.to_thread(pool.remove, name)
+        return
+    await asyncio.to_thread(pool.mark_ready, name)
+
+async def collect_pool_repo(name: str, status: str):
+    if status == "claimed":
+        # It may have been renamed already and the old name redirects to it, so only forget it
+        await asyncio.to_thread(get_repo_pool().remove, name)
+        return
+    try:
+        await delete_github_repo(name)
+    except Exception as e:
+        print(f"Failed to collect pool repo {name}: {e}")
+        return
+    await asyncio.to_thread(get_repo_pool().remove, name)
+
+async def maintain_repo_pool():
+    pool = get_repo_pool()
+    while True:
+        try:
+            for name, status in await asyncio.to_thread(pool.stale):
+                await collect_pool_repo(name, status)
+            names = await asyncio.to_thread(pool.reserve, REPO_POOL_SIZE)
+            if names:
+                print(f"Adding {len(names)} repos to the pool")
+                await asyncio.gather(*(add_pool_repo(name) for name in names))
+        except Exception as e:
+            print(f"Repo pool maintenance failed: {e}")
+        try:
+            await asyncio.wait_for(repo_pool_wakeup.wait(), timeout=REPO_POOL_REFILL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        repo_pool_wakeup.clear()
+
+async def provision_repo(repo_name: str, journal: StageJournal = NO_JOURNAL) -> dict:
+    # A pooled repo already has Pages enabled, so renaming it replaces both setup steps
+    if REPO_POOL_SIZE > 0 and journal.done("repo_created") is None:
+        pool = get_repo_pool()
+        name = await asyncio.to_thread(pool.claim)
+        if name is not None:
+            repo_info = None
+            try:
+                with metrics.timed("rename_repo"):
+                    repo_info = await rename_github_repo(name, repo_name)
+            finally:
+                # e.g. the target already exists from an earlier attempt, keep the pooled repo for the next task.
+                # The pool is refilled only once the claim is settled, so maintenance never sees it half done.
+                await asyncio.to_thread(pool.remove if repo_info is not None else pool.release, name)
+                if repo_pool_wakeup is not None:
+                    repo_pool_wakeup.set()
+            if repo_info is not None:
+                metrics.inc("repo_pool_claims_total", result="hit")
+                print(f"Repository {name} from the pool renamed to {repo_name}")
+                await asyncio.to_thread(journal.record, "repo_created", repo_info={"html_url": repo_info.get("html_url", "")})
+                await asyncio.to_thread(journal.record, "pages_enabled")
+                return repo_info
+        metrics.inc("repo_pool_claims_total", result="miss")
+    return await setup_repo(repo_name, journal)
+
+async def run_round(job: dict):
+    data = job["data"]
+    # Keyed like the job itself, so a resubmitted failed task also resumes
+    journal = await asyncio.to_thread(StageJournal, JOURNAL_DIR, job["key"])
+    round_num = data.get("round")
+    if round_num == 1:
+        with metrics.timed("round1"):
+            result = await round1(data, journal)
+    elif round_num == 2:
+        with metrics.timed("round2"):
+            result = await round2(data, journal)
+    else:
+        return {"error": "Invalid round"}
+    if "error" not in result:
+        await asyncio.to_thread(journal.remove)
+    return result
+
+def job_status(job: dict) -> dict:
+    return {k: v for k, v in job.items() if k not in ("data", "key", "heartbeat_at")}
+
+async def send_heartbeats(job_id: str, worker: str):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await asyncio.to_thread(get_job_store().heartbeat, job_id, worker)
+        except Exception as e:
+            # e.g. the database is locked by another process, the next beat is soon enough
+            metrics.inc("errors_total", stage="job_store")
+            print(f"Failed to send heartbeat for job {job_id}: {e}")
+
+async def notify_evaluation_url(data: dict, repo_name: str, commit_sha: str) -> str:
+    payload = {
+        "email": data.get("email"),
+        "task": data.get("task"),
+        "round": data.get("round"),
+        "nonce": data.get("nonce"),
+        "repo_url": f"https://github.com/{GITHUB_USERNAME}/{repo_name}",
+        "commit_sha": commit_sha,
+        "pages_url": f"https://{GITHUB_USERNAME}.github.io/{repo_name}/",
+    }
+    for attempt in range(4):
+        try:
+            response = await get_http_client().post(data["evaluation_url"], json=payload)
+            if response.status_code == 200:
+                return "sent"
+            print(f"evaluation_url answered {response.status_code}: {response.text}")
+        except httpx.HTTPError as e:
+            print(f"Failed to notify evaluation_url: {e}")
+        await asyncio.sleep(2 ** attempt)
+    return "failed"
+
+async def track_pages(job: dict, result: dict, timeout: float = PAGES_WAIT_TIMEOUT):
+    # Runs after the job has finished, so waiting for GitHub doesn't keep a worker busy
+    repo_name = result["repo_name"]
+    start = time.perf_counter()
+    commit_sha = None
+    try:
+        commit_sha = await get_head_sha(repo_name)
+        status = await wait_for_pages(repo_name, commit_sha, timeout)
+    except Exception as e:
+        print(f"Failed to track Pages build for {repo_name}: {e}")
+        status = "error"
+    pages_status = "ready" if status == "built" else status
+    metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="pages_ready")
+    metrics.inc("pages_builds_total", status=pages_status)
+    print(f"Pages for {repo_name}: {pages_status} after {time.perf_counter() - start:.1f}s")
+
+    updates = {"pages_status": pages_status, "commit_sha": commit_sha}
+    if pages_status == "ready" and job["data"].get("evaluation_url"):
+        updates["callback_status"] = await notify_evaluation_url(job["data"], repo_name, commit_sha)
+    await asyncio.to_thread(get_job_store().update_result, job["id"], updates)
+    emit_job_event("pages", job_id=job["id"], **updates)
+
+# Running Pages waiters, referenced so they aren't garbage collected
+pages_waiters: set[asyncio.Task] = set()
+
+def start_pages_waiter(job: dict, result: dict, timeout: float = PAGES_WAIT_TIMEOUT):
+    waiter = asyncio.create_task(track_pages(job, result, timeout))
+    pages_waiters.add(waiter)
+    waiter.add_done_callback(pages_waiters.discard)
+
+async def expire_pages_waits():
+    # Waiters lost with their process (crash, or another process restarted) would otherwise stay pending forever
+    store = get_job_store()
+    while True:
+        try:
+            for job_id in await asyncio.to_thread(store.expire_pages, time.time() - PAGES_WAIT_TIMEOUT - 60):
+                print(f"Gave up on the Pages build of job {job_id}, its waiter went away")
+                emit_job_event("pages", job_id=job_id, pages_status="timeout")
+        except Exception as e:
+            metrics.inc("errors_total", stage="job_store")
+            print(f"Failed to expire Pages waits: {e}")
+        await asyncio.sleep(60)
+
+async def job_worker(worker: str):
+    store = get_job_store()
+    while True:
+        job_wakeup.clear()
+        try:
+            job = await asyncio.to_thread(store.claim, worker)
+        except Exception as e:
+            metrics.inc("errors_total", stage="job_store")
+            print(f"Worker {worker} failed to claim a job: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        metrics.observe("stage_duration_seconds", job["started_at"] - job["created_at"], stage="queue_wait")
+        metrics.observe("job_queue_wait_seconds", job["started_at"] - job["created_at"], priority=job["priority"])
+        print(f"Worker {worker} picked up job {job['id']} (round={job['round']}, task={job['task']}, attempt={job['attempts']})")
+        emit_job_event("status", job_id=job["id"], status="running", attempt=job["attempts"])
+        heartbeat = asyncio.create_task(send_heartbeats(job["id"], worker))
+        token = current_job_id.set(job["id"])
+        try:
+            result = await run_round(job)
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            raise
+        except Exception as e:
+            result = {"error": str(e)}
+        finally:
+            current_job_id.reset(token)
+
+        status = "failed" if "error" in result else "completed"
+        track = PAGES_WAIT and status == "completed" and "repo_name" in result
+        if track:
+            result["pages_status"] = "pending"
+        # Heartbeats go on until the result is stored, so no other worker takes the job over meanwhile
+        attempt = 0
+        while True:
+            try:
+                finished_at = await asyncio.to_thread(store.finish, job["id"], worker, status, result)
+                break
+            except Exception as e:
+                metrics.inc("errors_total", stage="job_store")
+                print(f"Failed to store the result of job {job['id']}, retrying: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+                attempt += 1
+        heartbeat.cancel()
+        emit_job_event("status", job_id=job["id"], status=status, seconds=round(finished_at - job["started_at"], 3), result=result)
+        if track:
+            start_pages_waiter(job, result)
+        metrics.inc("jobs_total", round=job["round"], status=status)
+        print(f"Job {job['id']} {status} in {finished_at - job['started_at']:.1f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global job_wakeup, repo_pool_wakeup, http_client
+    http_client = create_http_client()
+    job_wakeup = asyncio.Event()
+    repo_pool_wakeup = asyncio.Event()
+    store = get_job_store()
+    if WEB_CONCURRENCY == 1:
+        # Jobs interrupted by a restart resume now instead of after JOB_STALE_SECONDS
+        requeued = await asyncio.to_thread(store.requeue_running)
+        if requeued:
+            print(f"Resuming {requeued} jobs interrupted by a restart")
+        if PAGES_WAIT:
+            # Likewise for Pages builds still being followed when the server stopped
+            for job in await asyncio.to_thread(store.pending_pages):
+                remaining = PAGES_WAIT_TIMEOUT - (time.time() - job["finished_at"])
+                if remaining > 0:
+                    print(f"Resuming the Pages wait of job {job['id']}")
+                    start_pages_waiter(job, job["result"], remaining)
+    await asyncio.to_thread(clean_journal, JOURNAL_DIR)
+    if GITHUB_PUSH_MODE == "git":
+        await asyncio.to_thread(evict_git_mirrors, GIT_MIRROR_DIR)
+    workers = [asyncio.create_task(job_worker(f"{os.getpid()}-{i}")) for i in range(JOB_WORKERS)]
+    if REPO_POOL_SIZE > 0:
+        workers.append(asyncio.create_task(maintain_repo_pool()))
+    if PAGES_WAIT:
+        workers.append(asyncio.create_task(expire_pages_waits()))
+    workers.append(asyncio.create_task(flush_job_events()))
+    yield
+    tasks = workers + list(pages_waiters)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await write_job_events()
+    await http_client.aclose()
+    http_client = None
+
+app = FastAPI(title="Captcha Solver Agent", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -620,16 +3242,209 @@ async def handle_task(data: dict):
     if not validate_secret(data.get("secret", "")):
         return {"error": "Invalid secret"}
     
-    round_num = data.get("round")
-    if round_num == 1:
-        result = round1(data)
-        return result
-    elif round_num == 2:
-        result = round2(data)
-        return result
-    else:
+    if data.get("round") not in (1, 2):
         return {"error": "Invalid round"}
 
+    job, created = await asyncio.to_thread(get_job_store().submit, data)
+    if not created:
+        duplicate = job
+        print(f"Duplicate request for job {duplicate['id']} ({duplicate['status']})")
+        if duplicate["status"] == "completed":
+            return {"message": "Task already completed", "job_id": duplicate["id"], **job_status(duplicate)}
+        return JSONResponse(
+            status_code=202,
+            content={
+                "message": "Task already in progress",
+                "job_id": duplicate["id"],
+                "status": duplicate["status"],
+                "status_url": f"/jobs/{duplicate['id']}",
+                "events_url": f"/jobs/{duplicate['id']}/events",
+            },
+        )
+
+    emit_job_event("status", job_id=job["id"], status="queued")
+    job_wakeup.set()
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Task accepted",
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"/jobs/{job['id']}",
+            "events_url": f"/jobs/{job['id']}/events",
+        },
+    )
+
+@app.post("/handle_tasks")
+async def handle_tasks(data: dict | list = Body(...)):
+    # Either {"secret": ..., "tasks": [...]} or a list of /handle_task payloads
+    tasks = data if isinstance(data, list) else data.get("tasks")
+    if not isinstance(tasks, list) or not tasks:
+        return JSONResponse(status_code=400, content={"error": "Expected a non-empty list of tasks"})
+    if len(tasks) > BATCH_MAX_TASKS:
+        return JSONResponse(status_code=413, content={"error": f"At most {BATCH_MAX_TASKS} tasks per batch"})
+    print(f"Received batch of {len(tasks)} tasks")
+
+    # Each distinct secret is checked once, not once per task
+    shared_secret = data.get("secret") if isinstance(data, dict) else None
+    # Only task objects carry a secret, a batch without any still needs the shared one
+    secrets = {task.get("secret", shared_secret) for task in tasks if isinstance(task, dict)} or {shared_secret}
+    if not all(validate_secret(secret or "") for secret in secrets):
+        return {"error": "Invalid secret"}
+
+    valid = [i for i, task in enumerate(tasks) if isinstance(task, dict) and task.get("round") in (1, 2)]
+    batch_id, submitted = await asyncio.to_thread(get_job_store().submit_batch, [tasks[i] for i in valid])
+
+    # Entries that aren't task objects are reported at their own index instead of failing the batch
+    jobs = [{"index": i, "error": "Invalid round" if isinstance(task, dict) else "Invalid task"} for i, task in enumerate(tasks)]
+    created_count = 0
+    for i, (job, created) in zip(valid, submitted):
+        jobs[i] = {"index": i, "job_id": job["id"], "status": job["status"], "created": created}
+        if created:
+            created_count += 1
+            emit_job_event("status", job_id=job["id"], status="queued")
+    if created_count:
+        job_wakeup.set()
+    print(f"Batch {batch_id}: {created_count} new jobs, {len(valid) - created_count} already known, {len(tasks) - len(valid)} invalid")
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Tasks accepted",
+            "batch_id": batch_id,
+            "status_url": f"/batches/{batch_id}",
+            "jobs": jobs,
+        },
+    )
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str, include_jobs: bool = True):
+    jobs = await asyncio.to_thread(get_job_store().batch, batch_id)
+    if not jobs:
+        return JSONResponse(status_code=404, content={"error": "Batch not found"})
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    status = {
+        "batch_id": batch_id,
+        "total": len(jobs),
+        "counts": counts,
+        "done": counts.get("queued", 0) + counts.get("running", 0) == 0,
+    }
+    if include_jobs:
+        status["jobs"] = [job_status(job) for job in jobs]
+    return status
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job_status(job)
+
+def sse_message(event: str, data: dict, event_id: int | None = None) -> str:
+    message = f"id: {event_id}\n" if event_id is not None else ""
+    return message + f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def ends_event_stream(event: str, data: dict) -> bool:
+    # The job is done, and so is its Pages tracking if there is any
+    if event == "pages":
+        return True
+    if event == "status" and data.get("status") in ("completed", "failed"):
+        return (data.get("result") or {}).get("pages_status") != "pending"
+    return False
+
+async def job_event_stream(request: Request, job_id: str, after_id: int):
+    store = get_job_store()
+    last_sent = time.monotonic()
+    yield "retry: 2000\n\n"
+    while True:
+        events = await asyncio.to_thread(store.events, job_id, after_id)
+        for event in events:
+            after_id = event["id"]
+            data = {"at": event["at"], **event["data"]}
+            yield sse_message(event["type"], data, event["id"])
+            if ends_event_stream(event["type"], data):
+                return
+        if events:
+            last_sent = time.monotonic()
+            continue
+
+        # Jobs that finished before their events were recorded (or whose events expired) get one final status
+        job = await asyncio.to_thread(store.get, job_id)
+        if job is None:
+            return
+        # as do jobs whose Pages waiter went away without reporting
+        if job["finished_at"] is not None and time.time() - job["finished_at"] > 1:
+            data = {"at": job["finished_at"], "status": job["status"], "result": job["result"]}
+            pending = (job["result"] or {}).get("pages_status") == "pending"
+            if not pending or time.time() - job["finished_at"] > PAGES_WAIT_TIMEOUT:
+                if pending:
+                    # Reported as final so clients stop reconnecting
+                    data["result"] = {**job["result"], "pages_status": "timeout"}
+                yield sse_message("status", data)
+                return
+
+        if await request.is_disconnected():
+            return
+        if time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    # Set by EventSource when it reconnects, so nothing is sent twice
+    last_event_id = request.headers.get("last-event-id", "")
+    after_id = int(last_event_id) if last_event_id.isdigit() else 0
+    return StreamingResponse(
+        job_event_stream(request, job_id, after_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/cache")
+async def cache_stats():
+    cache = get_generation_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(cache.stats)}
+
+@app.get("/github/rate_limit")
+async def github_rate_limit():
+    return github_rate_limiter.stats()
+
+@app.get("/llm/backends")
+async def llm_backends():
+    return {"hedge": LLM_HEDGE, "backends": [backend.stats() for backend in llm_router.ranked()]}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    counts = await asyncio.to_thread(get_job_store().counts)
+    limiter = github_rate_limiter.stats()
+    gauges = {
+        "jobs": {(("status", status),): counts.get(status, 0) for status in ("queued", "running", "completed", "failed")},
+        "github_rate_limit_tokens": {(): limiter["tokens"]},
+        "repo_cache_entries": {(): len(repo_cache.repos)},
+        "jobs_queued": {(("priority", priority),): 0 for priority in (PRIORITY_HIGH, PRIORITY_NORMAL)},
+        "jobs_oldest_queued_seconds": {(("priority", priority),): 0 for priority in (PRIORITY_HIGH, PRIORITY_NORMAL)},
+    }
+    for priority, (count, oldest) in (await asyncio.to_thread(get_job_store().queue_stats)).items():
+        gauges["jobs_queued"][(("priority", priority),)] = count
+        gauges["jobs_oldest_queued_seconds"][(("priority", priority),)] = round(oldest, 3)
+    for limit in (llm_limit, github_limit):
+        stats = limit.stats()
+        gauges[f"{limit.name}_in_flight"] = {(): stats["in_flight"]}
+        gauges[f"{limit.name}_waiting"] = {(): stats["waiting"]}
+    if limiter["remaining"] is not None:
+        gauges["github_rate_limit_remaining"] = {(): limiter["remaining"]}
+    if REPO_POOL_SIZE > 0:
+        pool_counts = await asyncio.to_thread(get_repo_pool().counts)
+        gauges["repo_pool"] = {(("status", status),): pool_counts.get(status, 0) for status in ("creating", "ready", "claimed")}
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
 @app.get("/test")
 async def test_endpoint():
     """Test endpoint to check if server is running"""
@@ -643,6 +3458,14 @@ async def frontend_info():
         "endpoints": {
             "main": "/",
             "api": "/handle_task",
+            "batch_api": "/handle_tasks",
+            "batches": "/batches/{batch_id}",
+            "jobs": "/jobs/{job_id}",
+            "job_events": "/jobs/{job_id}/events",
+            "cache": "/cache",
+            "github_rate_limit": "/github/rate_limit",
+            "llm_backends": "/llm/backends",
+            "metrics": "/metrics",
             "health": "/health"
         }
     }
@@ -654,4 +3477,9 @@ if __name__ == "__main__":
     print(f"OpenAI API Key set: {'YES' if os.getenv('OPENAI_API_KEY') else 'NO'}")
     
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if WEB_CONCURRENCY > 1:
+        # Worker processes import the app themselves and share jobs through STATE_DB_PATH
+        print(f"Starting {WEB_CONCURRENCY} worker processes")
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Keep importing main from creating the cache, state database and journal on disk
+os.environ.update(LLM_CACHE_PATH="", STATE_DB_PATH=":memory:", JOURNAL_DIR="")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
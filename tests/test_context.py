@@ -0,0 +1,19 @@
+import main
+from main import truncate_to_tokens
+
+
+def test_truncate_to_tokens_leaves_small_files_alone():
+    content = "line\n" * 10
+    assert truncate_to_tokens(content, 100) == content
+
+
+def test_truncate_to_tokens_keeps_head_and_tail():
+    lines = [f"line {i:04d}" for i in range(1000)]
+    result = truncate_to_tokens("\n".join(lines), 300).splitlines()
+    marker = next(i for i, line in enumerate(result) if "lines omitted" in line)
+    head, tail = result[:marker], result[marker + 1:]
+    assert head == lines[:len(head)]
+    assert tail == lines[len(lines) - len(tail):]
+    assert len(head) > len(tail) > 0
+    assert result[marker] == f"... [{1000 - len(head) - len(tail)} lines omitted] ..."
+    assert main.estimate_tokens("\n".join(result)) <= 300
@@ -0,0 +1,26 @@
+import subprocess
+
+import pytest
+
+from main import git_blob_sha, is_unchanged, missing_files
+
+
+@pytest.mark.parametrize("content", ["", "hello\n", "ünïcödé ✓\r\n", "<html>\n" * 1000])
+def test_blob_sha_matches_git(content):
+    expected = subprocess.run(["git", "hash-object", "--stdin"], input=content.encode("utf-8"), capture_output=True, check=True)
+    assert git_blob_sha(content) == expected.stdout.decode().strip()
+
+
+def test_unchanged_only_when_content_matches():
+    known = {"index.html": git_blob_sha("<h1>hi</h1>")}
+    assert is_unchanged({"name": "index.html", "content": "<h1>hi</h1>"}, known)
+    assert not is_unchanged({"name": "index.html", "content": "<h1>hi</h1>\n"}, known)
+    assert not is_unchanged({"name": "app.js", "content": "<h1>hi</h1>"}, known)
+    # Unknown listing, everything is pushed
+    assert not is_unchanged({"name": "index.html", "content": "<h1>hi</h1>"}, None)
+
+
+def test_missing_files_keep_the_license():
+    known = {"index.html": "a", "old.js": "b", "LICENSE": "c", "assets/x.css": "d"}
+    assert missing_files(known, [{"name": "index.html", "content": ""}]) == ["assets/x.css", "old.js"]
+    assert missing_files(None, []) == []
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import subprocess
+
+import pytest
+
+import main
+
+IDENTITY = {"GIT_AUTHOR_NAME": "someone", "GIT_AUTHOR_EMAIL": "someone@example.com",
+            "GIT_COMMITTER_NAME": "someone", "GIT_COMMITTER_EMAIL": "someone@example.com"}
+
+
+def run(*args: str, cwd=None) -> str:
+    return subprocess.run(args, cwd=cwd, check=True, capture_output=True, text=True, env={**os.environ, **IDENTITY}).stdout
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "GIT_REMOTE_URL", f"file://{tmp_path}/remotes/{{repo}}.git")
+    monkeypatch.setattr(main, "GIT_MIRROR_DIR", str(tmp_path / "mirrors"))
+    monkeypatch.setattr(main, "repo_cache", main.RepoMetadataCache(16))
+    path = tmp_path / "remotes" / "site.git"
+    run("git", "init", "--quiet", "--bare", "--initial-branch=main", str(path))
+    return path
+
+
+def push(files: dict[str, str], only_changed=True, delete_missing=False) -> dict:
+    files = [{"name": name, "content": content} for name, content in files.items()]
+    return asyncio.run(main.push_files_with_git("site", files, 2, only_changed, delete_missing))
+
+
+def push_from_elsewhere(remote, tmp_path, files: dict[str, str]):
+    checkout = tmp_path / "elsewhere"
+    if not checkout.exists():
+        run("git", "clone", "--quiet", str(remote), str(checkout))
+    run("git", "pull", "--quiet", cwd=checkout)
+    for name, content in files.items():
+        (checkout / name).write_text(content)
+    run("git", "add", "-A", cwd=checkout)
+    run("git", "commit", "--quiet", "-m", "external", cwd=checkout)
+    run("git", "push", "--quiet", "origin", "HEAD:main", cwd=checkout)
+
+
+def remote_file(remote, name: str) -> str:
+    return run("git", f"--git-dir={remote}", "show", f"main:{name}")
+
+
+def test_push_to_empty_remote_then_only_changed(remote):
+    assert push({"index.html": "v1", "README.md": "# site"}, only_changed=False)["pushed"] == ["index.html", "README.md"]
+    summary = push({"index.html": "v2", "README.md": "# site"})
+    assert summary["pushed"] == ["index.html"]
+    assert summary["unchanged"] == ["README.md"]
+    assert remote_file(remote, "index.html") == "v2"
+
+
+def test_stale_mirror_is_refreshed_before_diffing(remote, tmp_path):
+    push({"index.html": "ours"}, only_changed=False)
+    push_from_elsewhere(remote, tmp_path, {"index.html": "external"})
+
+    # Same content as the mirror's old head, but not as the remote
+    summary = push({"index.html": "ours"})
+    assert summary["pushed"] == ["index.html"]
+    assert remote_file(remote, "index.html") == "ours"
+
+
+def test_files_added_elsewhere_are_deleted(remote, tmp_path):
+    push({"index.html": "ours"}, only_changed=False)
+    push_from_elsewhere(remote, tmp_path, {"extra.txt": "external"})
+
+    summary = push({"index.html": "ours"}, delete_missing=True)
+    assert summary["deleted"] == ["extra.txt"]
+    assert run("git", f"--git-dir={remote}", "ls-tree", "--name-only", "main").split() == ["index.html"]
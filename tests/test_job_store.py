@@ -0,0 +1,101 @@
+import pytest
+
+import main
+from main import JobStore
+
+
+def task(name: str, round_num: int = 1, nonce: str = "n") -> dict:
+    return {"task": name, "nonce": nonce, "round": round_num, "secret": "s"}
+
+
+@pytest.fixture
+def store() -> JobStore:
+    return JobStore(":memory:")
+
+
+def test_same_task_nonce_and_round_is_one_job(store):
+    job, created = store.submit(task("captcha-1"))
+    again, created_again = store.submit(task("captcha-1"))
+    assert created and not created_again
+    assert again["id"] == job["id"]
+    assert "secret" not in job["data"]
+
+
+def test_nonce_and_round_make_new_jobs(store):
+    ids = {store.submit(data)[0]["id"] for data in [task("captcha-1"), task("captcha-1", nonce="m"), task("captcha-1", 2)]}
+    assert len(ids) == 3
+
+
+def test_completed_job_is_reused_and_failed_job_retried(store):
+    job, _ = store.submit(task("captcha-1"))
+    store.claim("w")
+    store.finish(job["id"], "w", "completed", {"message": "done"})
+    assert store.submit(task("captcha-1")) == (store.get(job["id"]), False)
+
+    other, _ = store.submit(task("captcha-2"))
+    store.claim("w")
+    store.finish(other["id"], "w", "failed", {"error": "boom"})
+    retry, created = store.submit(task("captcha-2"))
+    assert created and retry["id"] != other["id"]
+
+
+
+def stop_heartbeats(store: JobStore, job_id: str):
+    store.conn.execute("UPDATE jobs SET heartbeat_at = heartbeat_at - ? WHERE id = ?", (main.JOB_STALE_SECONDS + 1, job_id))
+
+
+def test_running_job_is_taken_over_only_once_heartbeats_stop(store):
+    job, _ = store.submit(task("captcha-1"))
+    assert store.claim("first")["id"] == job["id"]
+    store.heartbeat(job["id"], "first")
+    assert store.claim("second") is None
+
+    stop_heartbeats(store, job["id"])
+    taken = store.claim("second")
+    assert taken["id"] == job["id"] and taken["attempts"] == 2
+    # The first worker no longer owns it, so its late result is dropped
+    store.finish(job["id"], "first", "failed", {"error": "late"})
+    store.finish(job["id"], "second", "completed", {"message": "done"})
+    assert store.get(job["id"])["result"] == {"message": "done"}
+
+
+def test_job_abandoned_after_max_attempts(store, monkeypatch):
+    monkeypatch.setattr(main, "JOB_MAX_ATTEMPTS", 2)
+    job, _ = store.submit(task("captcha-1"))
+    for worker in ["first", "second"]:
+        assert store.claim(worker)["id"] == job["id"]
+        stop_heartbeats(store, job["id"])
+    assert store.claim("third") is None
+    abandoned = store.get(job["id"])
+    assert abandoned["status"] == "failed"
+    assert abandoned["result"] == {"error": "Job abandoned after 2 attempts"}
+
+
+def submit_in_order(store: JobStore, tasks: list[dict]) -> list[str]:
+    # Distinct creation times, so "oldest first" doesn't depend on the clock resolution
+    ids = []
+    for i, data in enumerate(tasks):
+        job, _ = store.submit(data)
+        store.conn.execute("UPDATE jobs SET created_at = ? WHERE id = ?", (1000 + i, job["id"]))
+        ids.append(job["id"])
+    return ids
+
+
+def claim_all(store: JobStore) -> list[str]:
+    claimed = []
+    while (job := store.claim("w")) is not None:
+        claimed.append(job["task"])
+    return claimed
+
+
+def test_round_2_and_resubmitted_failures_go_first(store):
+    job, _ = store.submit(task("retry-1"))
+    store.claim("w")
+    store.finish(job["id"], "w", "failed", {"error": "boom"})
+    submit_in_order(store, [task("new-1"), task("fix-1", 2), task("retry-1")])
+    assert claim_all(store) == ["fix-1", "retry-1", "new-1"]
+
+
+def test_prefixes_with_fewer_running_jobs_go_first(store):
+    submit_in_order(store, [task("alpha-1"), task("alpha-2"), task("alpha-3"), task("beta-1"), task("gamma-1")])
+    assert claim_all(store) == ["alpha-1", "beta-1", "gamma-1", "alpha-2", "alpha-3"]
@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import main
+
+
+class FlakyJobStore(main.JobStore):
+    """Raises "database is locked" on the first call of each method, as under contention from another process."""
+
+    def __init__(self):
+        super().__init__(":memory:")
+        self.failed = set()
+        self.heartbeats = 0
+
+    def fail_once(self, name: str):
+        if name not in self.failed:
+            self.failed.add(name)
+            raise sqlite3.OperationalError("database is locked")
+
+    def claim(self, worker):
+        self.fail_once("claim")
+        return super().claim(worker)
+
+    def heartbeat(self, job_id, worker):
+        self.fail_once("heartbeat")
+        self.heartbeats += 1
+        return super().heartbeat(job_id, worker)
+
+    def finish(self, job_id, worker, status, result):
+        self.fail_once("finish")
+        return super().finish(job_id, worker, status, result)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FlakyJobStore()
+    monkeypatch.setattr(main, "job_store", store)
+    monkeypatch.setattr(main, "JOB_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(main, "JOB_HEARTBEAT_SECONDS", 0.05)
+    monkeypatch.setattr(main, "PAGES_WAIT", False)
+    return store
+
+
+def test_worker_survives_job_store_errors(store, monkeypatch):
+    async def run_round(job):
+        await asyncio.sleep(0.3)
+        return {"message": "done"}
+
+    monkeypatch.setattr(main, "run_round", run_round)
+
+    async def run():
+        main.job_wakeup = asyncio.Event()
+        job, _ = store.submit({"task": "t-1", "nonce": "n", "round": 1})
+        worker = asyncio.create_task(main.job_worker("w"))
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if store.get(job["id"])["status"] == "completed":
+                break
+        worker.cancel()
+        return store.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "completed"
+    assert store.failed == {"claim", "heartbeat", "finish"}
+    # Beats went on after the failed one
+    assert store.heartbeats >= 2
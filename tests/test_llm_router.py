@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+
+import main
+from main import LLMBackend, LLMRouter
+
+
+class FakeClient:
+    """Answers each backend after its own delay."""
+
+    def __init__(self, delays: dict[str, float | None]):
+        self.delays = delays
+
+    async def post(self, url, **kwargs):
+        host = httpx.URL(url).host
+        if self.delays[host] is None:
+            raise httpx.ConnectError("refused")
+        await asyncio.sleep(self.delays[host])
+        return httpx.Response(200, json={"choices": [{"message": {"content": host}}]}, request=httpx.Request("POST", url))
+
+
+def make_router(monkeypatch, delays: dict[str, float | None]) -> LLMRouter:
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setattr(main, "LLM_HEDGE", True)
+    monkeypatch.setattr(main, "LLM_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(main, "get_http_client", lambda: FakeClient(delays))
+    return LLMRouter([LLMBackend(name, f"http://{name}", "OPENAI_API_KEY", "model") for name in delays])
+
+
+def test_lost_hedge_is_not_a_latency_sample(monkeypatch):
+    router = make_router(monkeypatch, {"fast": 0.1, "slow": 5})
+
+    async def run():
+        primaries = []
+        for _ in range(4):
+            primaries.append(router.ranked()[0].name)
+            assert await router.complete("prompt") == "fast"
+        return primaries
+
+    assert asyncio.run(run()) == ["fast"] * 4
+    slow = router.backends[1]
+    assert not slow.latencies
+    assert slow.cancelled
+    assert [backend.name for backend in router.ranked()] == ["fast", "slow"]
+
+
+def test_hedge_wins_when_primary_is_slow(monkeypatch):
+    router = make_router(monkeypatch, {"slow": 5, "fast": 0.05})
+
+    async def run():
+        return await router.complete("prompt")
+
+    assert asyncio.run(run()) == "fast"
+    assert [backend.name for backend in router.ranked()] == ["fast", "slow"]
+
+
+def test_hedge_waits_for_the_backend_in_flight(monkeypatch):
+    # The first backend fails at once, the second is in flight and is given its own p95 before hedging
+    router = make_router(monkeypatch, {"down": None, "steady": 0.2, "spare": 0.01})
+    down, steady, spare = router.backends
+    down.latencies.extend([0.01] * 10)
+    steady.latencies.extend([0.5] * 10)
+    spare.latencies.extend([1.0] * 10)
+
+    async def run():
+        return await router.complete("prompt")
+
+    assert asyncio.run(run()) == "steady"
+    assert not spare.cancelled
@@ -0,0 +1,102 @@
+import json
+
+import main
+from main import FileStreamParser, GeneratedFiles, parse_llm_files
+
+FILES = [
+    {"name": "index.html", "content": "<h1>{ [hi] }</h1>"},
+    {"name": "script.js", "content": "const a = \"}\";\nconsole.log([a]);"},
+]
+
+
+def feed_in_chunks(parser: FileStreamParser, text: str, size: int) -> list[dict]:
+    files = []
+    for i in range(0, len(text), size):
+        files.extend(parser.feed(text[i:i + size]))
+    return files
+
+
+def test_stream_parser_reads_fenced_array_in_small_chunks():
+    text = "Here you go:\n```json\n" + json.dumps(FILES) + "\n```"
+    parser = FileStreamParser()
+    assert feed_in_chunks(parser, text, 3) == FILES
+    assert parser.finished
+    assert parser.partial_name() is None
+
+
+def test_stream_parser_skips_brackets_in_prose():
+    text = "Files [see below] and [1, 2]:\n" + json.dumps(FILES)
+    parser = FileStreamParser()
+    assert parser.feed(text) == FILES
+    assert parser.finished
+
+
+def test_stream_parser_truncated_stream_keeps_complete_files():
+    text = json.dumps(FILES + [{"name": "style.css", "content": "body { color: red; }"}])
+    text = text[:text.index("color")]
+    parser = FileStreamParser()
+    assert parser.feed(text) == FILES
+    assert not parser.finished
+    assert parser.partial_name() == "style.css"
+
+
+def test_stream_parser_ignores_text_after_array():
+    parser = FileStreamParser()
+    assert parser.feed(json.dumps(FILES[:1]) + ' and [{"name": "x", "content": "y"}]') == FILES[:1]
+    assert parser.feed('[{"name": "z", "content": "w"}]') == []
+
+
+def test_parse_llm_files_complete_array_with_trailing_prose():
+    files, finished, truncated = parse_llm_files("```json\n" + json.dumps(FILES) + "\n```\nLet me know [if] you need more.")
+    assert files == FILES
+    assert finished
+    assert truncated is None
+
+
+def test_parse_llm_files_accepts_raw_control_characters():
+    # Models often put real newlines and tabs inside JSON strings
+    text = '[{"name": "app.py", "content": "def f():\n\treturn 1\n"}]'
+    files, finished, _ = parse_llm_files(text)
+    assert files == [{"name": "app.py", "content": "def f():\n\treturn 1\n"}]
+    assert finished
+
+
+def test_parse_llm_files_repairs_truncated_response():
+    text = json.dumps(FILES + [{"name": "README.md", "content": "# Title\n\nLong text"}])[:-20]
+    files, finished, truncated = parse_llm_files(text)
+    assert files == FILES
+    assert not finished
+    assert truncated == "README.md"
+
+
+def test_parse_llm_files_without_array():
+    assert parse_llm_files("Sorry, I can't help with that.") == ([], False, None)
+
+
+def test_generated_files_rejects_unsafe_paths():
+    collected = GeneratedFiles()
+    for name in ["../escape.txt", "a/../../b.txt", "/etc/passwd", ".git/config", "C:/x.txt", "a\\b.txt", "", "x" * 256]:
+        assert collected.add({"name": name, "content": "x"}) is None
+    assert collected.list() == []
+
+
+def test_generated_files_normalises_and_drops_repeats():
+    collected = GeneratedFiles()
+    assert collected.add({"name": " ./index.html ", "content": "a"}) == {"name": "index.html", "content": "a"}
+    assert collected.add({"name": "index.html", "content": "b"}) is None
+    assert collected.add({"name": "package.json", "content": {"name": "app"}})["content"] == json.dumps({"name": "app"}, indent=2)
+    assert collected.add("not a file") is None
+    assert collected.add({"name": "missing.txt"}) is None
+    assert [file["name"] for file in collected.list()] == ["index.html", "package.json"]
+
+
+def test_generated_files_size_limits(monkeypatch):
+    monkeypatch.setattr(main, "LLM_MAX_FILE_BYTES", 10)
+    monkeypatch.setattr(main, "LLM_MAX_TOTAL_BYTES", 15)
+    collected = GeneratedFiles()
+    assert collected.add({"name": "big.txt", "content": "x" * 11}) is None
+    assert collected.add({"name": "a.txt", "content": "x" * 10}) is not None
+    assert collected.add({"name": "b.txt", "content": "x" * 6}) is None
+    assert collected.add({"name": "c.txt", "content": "x" * 5}) is not None
+    assert collected.total_bytes == 15
+
@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+from test_repo_cache import FakeGitHub
+
+
+@pytest.fixture
+def events(monkeypatch):
+    monkeypatch.setattr(main, "github_request", FakeGitHub().request)
+    monkeypatch.setattr(main, "repo_cache", main.RepoMetadataCache(16))
+    monkeypatch.setattr(main, "pending_job_events", [])
+    token = main.current_job_id.set("job")
+    yield main.pending_job_events
+    main.current_job_id.reset(token)
+
+
+def file_events(events) -> list[dict]:
+    return [json.loads(data) for _, _, event, data in events if event == "file"]
+
+
+def test_batched_push_reports_each_file_with_timing(events):
+    files = [{"name": "index.html", "content": "a"}, {"name": "app.js", "content": "b"}]
+    asyncio.run(main.push_files_to_repo("site", files, 1))
+    reported = file_events(events)
+    assert [(event["name"], event["state"]) for event in reported] == [("index.html", "pushed"), ("app.js", "pushed")]
+    assert all(event["seconds"] >= 0 for event in reported)
+
+
+def test_round_2_reports_unchanged_files(events):
+    asyncio.run(main.push_files_to_repo("site", [{"name": "index.html", "content": "a"}], 1))
+    events.clear()
+    files = [{"name": "index.html", "content": "a"}, {"name": "app.js", "content": "b"}]
+    asyncio.run(main.push_files_to_repo("site", files, 2, only_changed=True))
+    assert [(event["name"], event["state"]) for event in file_events(events)] == [("index.html", "unchanged"), ("app.js", "pushed")]
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from main import GitHubRateLimiter
+
+
+def timed_acquires(limiter: GitHubRateLimiter, count: int) -> float:
+    async def run():
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.acquire() for _ in range(count)))
+        return time.monotonic() - start
+
+    return asyncio.run(run())
+
+
+def test_burst_then_paced():
+    limiter = GitHubRateLimiter(rate=20, burst=5, reserve=0, max_wait=60)
+    assert timed_acquires(limiter, 5) < 0.05
+    # Five more at 20 per second
+    assert 0.2 <= timed_acquires(limiter, 5) < 0.5
+    assert limiter.requests == 10
+
+
+def test_rate_follows_remaining_budget():
+    limiter = GitHubRateLimiter(rate=10, burst=5, reserve=50, max_wait=60)
+    limiter.update(httpx.Response(200, headers={"x-ratelimit-remaining": "150", "x-ratelimit-reset": str(time.time() + 100)}))
+    # 100 requests left above the reserve, spread over 100 seconds
+    assert limiter.current_rate(time.time()) == pytest.approx(1.0, rel=0.05)
+
+
+def test_exhausted_budget_fails_fast_past_max_wait():
+    limiter = GitHubRateLimiter(rate=10, burst=5, reserve=50, max_wait=5)
+    limiter.update(httpx.Response(200, headers={"x-ratelimit-remaining": "10", "x-ratelimit-reset": str(time.time() + 3600)}))
+    start = time.monotonic()
+    with pytest.raises(Exception, match="rate limit exhausted"):
+        asyncio.run(limiter.acquire())
+    assert time.monotonic() - start < 0.1
+
+
+def test_short_pause_is_waited_out():
+    limiter = GitHubRateLimiter(rate=10, burst=5, reserve=0, max_wait=5)
+    limiter.blocked_until = time.time() + 0.2
+    assert 0.2 <= timed_acquires(limiter, 2) < 0.5
+
+
+def test_backoff_only_for_rate_limits():
+    limiter = GitHubRateLimiter(rate=10, burst=5, reserve=0, max_wait=60)
+    assert limiter.backoff(httpx.Response(404), 0) is None
+    assert limiter.backoff(httpx.Response(403, text="Resource not accessible"), 0) is None
+    delay = limiter.backoff(httpx.Response(429, headers={"retry-after": "3"}), 0)
+    assert 3 <= delay <= 6
+    assert limiter.blocked_until >= time.time() + 2
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+class FakeGitHub:
+    """Just enough of the git data API for one repo: ref, commits and trees, with ETags on the ref."""
+
+    def __init__(self):
+        self.trees = {"t0": {"LICENSE": "sha-license"}}
+        self.commits = {"c0": "t0"}
+        self.head = "c0"
+        self.calls = []
+
+    def ref_etag(self) -> str:
+        return f'"{self.head}"'
+
+    async def request(self, method: str, path: str, headers=None, json=None, params=None) -> httpx.Response:
+        path = path.split("/site", 1)[1]
+        self.calls.append((method, path))
+        if method == "GET" and path == "/git/ref/heads/main":
+            if (headers or {}).get("If-None-Match") == self.ref_etag():
+                return httpx.Response(304)
+            return httpx.Response(200, json={"object": {"sha": self.head}}, headers={"ETag": self.ref_etag()})
+        if method == "GET" and path.startswith("/git/commits/"):
+            return httpx.Response(200, json={"tree": {"sha": self.commits[path.rsplit("/", 1)[1]]}})
+        if method == "GET" and path.startswith("/git/trees/"):
+            sha = self.commits[self.head] if path.endswith("/main") else path.rsplit("/", 1)[1]
+            items = [{"path": name, "sha": blob, "type": "blob", "size": 1} for name, blob in self.trees[sha].items()]
+            return httpx.Response(200, json={"sha": sha, "tree": items})
+        if method == "POST" and path == "/git/trees":
+            tree = dict(self.trees[json["base_tree"]])
+            tree.update({entry["path"]: main.git_blob_sha(entry["content"]) for entry in json["tree"]})
+            sha = f"t{len(self.trees)}"
+            self.trees[sha] = tree
+            return httpx.Response(201, json={"sha": sha})
+        if method == "POST" and path == "/git/commits":
+            sha = f"c{len(self.commits)}"
+            self.commits[sha] = json["tree"]
+            return httpx.Response(201, json={"sha": sha})
+        if method == "PATCH" and path == "/git/refs/heads/main":
+            self.head = json["sha"]
+            return httpx.Response(200, json={"object": {"sha": self.head}})
+        raise AssertionError(f"unexpected {method} {path}")
+
+    def push_from_elsewhere(self, name: str, content: str):
+        tree = dict(self.trees[self.commits[self.head]])
+        tree[name] = main.git_blob_sha(content)
+        self.trees[f"t{len(self.trees)}"] = tree
+        self.commits[f"c{len(self.commits)}"] = f"t{len(self.trees) - 1}"
+        self.head = f"c{len(self.commits) - 1}"
+
+
+@pytest.fixture
+def github(monkeypatch):
+    fake = FakeGitHub()
+    monkeypatch.setattr(main, "github_request", fake.request)
+    monkeypatch.setattr(main, "repo_cache", main.RepoMetadataCache(16))
+    return fake
+
+
+def commit(files: dict[str, str]) -> str:
+    tree = [{"path": name, "mode": "100644", "type": "blob", "content": content} for name, content in files.items()]
+    return asyncio.run(main.commit_tree("site", tree, "message"))
+
+
+def listing() -> dict[str, str]:
+    return asyncio.run(main.get_file_shas("site"))
+
+
+def test_listing_after_our_push_is_revalidated_and_reused(github):
+    listing()
+    commit({"index.html": "v1"})
+    github.calls.clear()
+
+    assert listing()["index.html"] == main.git_blob_sha("v1")
+    # The head is read again, the tree our commit produced is not
+    assert github.calls == [("GET", "/git/ref/heads/main")]
+
+    github.calls.clear()
+    listing()
+    assert github.calls == [("GET", "/git/ref/heads/main")]
+    assert main.repo_cache.get("site").head_etag == github.ref_etag()
+
+
+def test_push_from_elsewhere_is_seen(github):
+    listing()
+    commit({"index.html": "v1"})
+    github.push_from_elsewhere("index.html", "external")
+
+    assert listing()["index.html"] == main.git_blob_sha("external")
+    commit({"index.html": "v1"})
+    assert github.trees[github.commits[github.head]]["index.html"] == main.git_blob_sha("v1")